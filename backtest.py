@@ -1,8 +1,27 @@
+import copy
+
+from .bar import Bar, Bars
 from .broker import Broker, Long, Short
+from .data_source import DataSource
+from .exit_book import is_level
+from .intrabar import LOW_FIRST, UNRESOLVED
+from .ledger import to_ns
+from .trade import CLOSE_STOP_LOSS, CLOSE_TAKE_PROFIT
 from .backtest_stats import BacktestStats
+from .optimize import Optimizer, DEFAULT_METRICS
+from .profiling import Profiler
+from .walk_forward import WalkForward
+
+
+# attributes that are either part of the state in another form or don't belong to it
+STATE_EXCLUDED_ATTRIBUTES = frozenset(('df', 'data_source', 'broker', 'bars', 'row', 'previous_row', 'stats', 'state',
+                                       'intrabar'))
 
 
 class Backtest:
+    # attributes that are not part of the state of a run, the data and read only inputs aren't copied with it
+    state_excluded_attributes = STATE_EXCLUDED_ATTRIBUTES
+
     def __init__(self,
                  df,
                  broker=None,
@@ -10,8 +29,17 @@ class Backtest:
                  enforce_stop_loss_first=True,
                  allow_same_row_exit=False,
                  on_stop_loss=None,
-                 on_take_profit=None):
-        self.df = df
+                 on_take_profit=None,
+                 columnar=True,
+                 lookback=0,
+                 intrabar=None):
+        # either a dataframe holding the whole history or a data source streaming it in chunks
+        if isinstance(df, DataSource):
+            self.df = None
+            self.data_source = df
+        else:
+            self.df = df
+            self.data_source = None
         self.broker = broker or Broker()
         self.index = -1
         self.row = None
@@ -22,86 +50,264 @@ class Backtest:
         self.allow_same_row_exit = allow_same_row_exit
         self.on_stop_loss = on_stop_loss
         self.on_take_profit = on_take_profit
+        # pull the columns out of the dataframe once and hand lightweight bars to next() instead of df.iloc rows
+        self.columnar = columnar
+        self.bars = None
+        # position of the current bar in self.bars, which only holds the current chunk of a streamed history
+        # and up to lookback bars before it
+        self.bar_index = -1
+        self.lookback = lookback
+        # optional IntrabarResolver with lower timeframe bars, which decides whether the stop loss or the take profit
+        # of a position came first when a bar reaches both, instead of the rules below
+        self.intrabar = intrabar
+        self.start_dt = None
+        self.end_dt = None
+        # position of the first bar of the run, which a run continued from a saved state keeps
+        self.run_start = -1
+        # state at the last bar of the previous run, if it was asked to save it
+        self.state = None
 
     def next(self):
         raise NotImplementedError
 
-    def run_positions_take_profit_and_stop_loss(self, ignore_positions=None):
+    def get_lookback(self, column, n):
+        # values of a column for the last n bars up to and including the current one,
+        # a streamed history keeps only lookback bars of the previous chunks around
+        assert self.data_source is None or n <= self.lookback + 1
+        return self.bars.columns[column][max(self.bar_index - n + 1, 0):self.bar_index + 1]
+
+    def run_positions_take_profit_and_stop_loss(self, ignore_positions=None, symbol=None):
+        # only the trades with a level inside the range of the bar can be closed, the exit book finds them
+        # and skips ahead over the bars where none of the levels is reached
+        exit_book = self.broker.get_exit_book(symbol)
+        if ignore_positions is None:
+            trades = exit_book.triggered(self.bar_index, self.bars.Low, self.bars.High)
+        else:
+            trades = [trade for trade in exit_book.crossed(self.row.Low, self.row.High)
+                      if trade not in ignore_positions]
+        if not trades:
+            return
         open_is_low = self.row.Open == self.row.Low
         open_is_high = self.row.Open == self.row.High
         open_gone_down = False if self.previous_row is None else self.row.Open < self.previous_row.Close
         open_gone_up = False if self.previous_row is None else self.row.Open > self.previous_row.Close
         to_be_closed = []
-        for trade in self.broker.positions:
-            if ignore_positions is not None and trade in ignore_positions:
-                continue
-            if isinstance(trade, Long):
+        for trade in trades:
+            # positions opened on this bar (ignore_positions is given) have no lower timeframe bars after their open
+            close_reason = None
+            if self.intrabar is not None and ignore_positions is None:
+                close_reason = self.resolve_intrabar(trade)
+            if close_reason == CLOSE_STOP_LOSS:
+                to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
+            elif close_reason == CLOSE_TAKE_PROFIT:
+                to_be_closed.append((trade, trade.take_profit, CLOSE_TAKE_PROFIT))
+            elif isinstance(trade, Long):
                 if self.enforce_stop_loss_first:
                     if trade.is_stop_loss(self.row.Low):
-                        to_be_closed.append((trade, trade.stop_loss, 0))
+                        to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                     elif trade.is_take_profit(self.row.High):
-                        to_be_closed.append((trade, trade.take_profit, 1))
+                        to_be_closed.append((trade, trade.take_profit, CLOSE_TAKE_PROFIT))
                 else:
                     if open_gone_down and trade.is_stop_loss(self.row.Open):
-                        to_be_closed.append((trade, trade.stop_loss, 0))
+                        to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                     elif open_is_low:
                         if trade.is_take_profit(self.row.High):
-                            to_be_closed.append((trade, trade.take_profit, 1))
+                            to_be_closed.append((trade, trade.take_profit, CLOSE_TAKE_PROFIT))
                         elif trade.is_stop_loss(self.row.Low):
-                            to_be_closed.append((trade, trade.stop_loss, 0))
+                            to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                     else:
                         if trade.is_stop_loss(self.row.Low):
-                            to_be_closed.append((trade, trade.stop_loss, 0))
+                            to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                         elif trade.is_take_profit(self.row.High):
-                            to_be_closed.append((trade, trade.take_profit, 1))
+                            to_be_closed.append((trade, trade.take_profit, CLOSE_TAKE_PROFIT))
             elif isinstance(trade, Short):
                 if self.enforce_stop_loss_first:
                     if trade.is_stop_loss(self.row.High):
-                        to_be_closed.append((trade, trade.stop_loss, 0))
+                        to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                     elif trade.is_take_profit(self.row.Low):
-                        to_be_closed.append((trade, trade.take_profit, 1))
+                        to_be_closed.append((trade, trade.take_profit, CLOSE_TAKE_PROFIT))
                 else:
                     if open_gone_up and trade.is_stop_loss(self.row.Open):
-                        to_be_closed.append((trade, trade.stop_loss, 0))
+                        to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                     elif open_is_high:
                         if trade.is_take_profit(self.row.Low):
-                            to_be_closed.append((trade, trade.take_profit, 1))
+                            to_be_closed.append((trade, trade.take_profit, CLOSE_TAKE_PROFIT))
                         elif trade.is_stop_loss(self.row.High):
-                            to_be_closed.append((trade, trade.stop_loss, 0))
+                            to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                     else:
                         if trade.is_stop_loss(self.row.High):
-                            to_be_closed.append((trade, trade.stop_loss, 0))
+                            to_be_closed.append((trade, trade.stop_loss, CLOSE_STOP_LOSS))
                         elif trade.is_take_profit(self.row.Low):
-                            to_be_closed.append((trade, trade.take_profit, 1))
+                            to_be_closed.append((trade, trade.take_profit, CLOSE_TAKE_PROFIT))
             else:
                 raise ValueError('trade is neither long or short')
-        for trade, price, close_type in to_be_closed:
-            self.broker.close_trade(price, trade, self.row.name, self.broker.maker_fee)
-            if close_type == 0:
+        # the margin fees of several shorts closed on the bar are computed together
+        shorts = [trade for trade, _, _ in to_be_closed if isinstance(trade, Short)]
+        margin_fees = dict(zip(shorts, self.broker.get_margin_fees(shorts, self.row.name))) if len(shorts) > 1 else {}
+        for trade, price, close_reason in to_be_closed:
+            self.broker.close_trade(price, trade, self.row.name, self.broker.maker_fee, close_reason,
+                                    margin_fees.get(trade))
+            if close_reason == CLOSE_STOP_LOSS:
                 if self.on_stop_loss is not None:
                     self.on_stop_loss(trade, price)
             elif self.on_take_profit is not None:
                 self.on_take_profit(trade, price)
 
-    def run(self, start=-1, end=-1):
-        self.index = 0 if start == -1 else start
-        end = len(self.df) if end == -1 else end
-        assert end > start
-        assert end <= len(self.df)
-        self.broker.reset()
-        while self.index < end:
-            self.row = self.df.iloc[self.index]
-            self.run_positions_take_profit_and_stop_loss()
-            if self.allow_same_row_exit:
-                positions_before = self.broker.positions.copy()
-            self.next()
-            if self.allow_same_row_exit:
-                self.run_positions_take_profit_and_stop_loss(positions_before)
-            self.index += 1
-            self.previous_row = self.row
+    def resolve_intrabar(self, trade):
+        # close reason of a trade whose stop loss and take profit are both reached by the bar, taken from the lower
+        # timeframe bars between the start of this bar and the next one, None if it has to be guessed
+        if isinstance(trade, Long):
+            low_level, high_level = trade.stop_loss, trade.take_profit
+        else:
+            low_level, high_level = trade.take_profit, trade.stop_loss
+        if not is_level(low_level) or not is_level(high_level):
+            return None
+        if self.row.Low > low_level or self.row.High < high_level:
+            return None
+        start_ns = to_ns(self.row.name)
+        index = self.bars.index
+        if self.bar_index + 1 < len(index):
+            end_ns = to_ns(index[self.bar_index + 1])
+        elif self.bar_index > 0:
+            # last bar there is, assume it is as long as the one before
+            end_ns = 2 * start_ns - to_ns(index[self.bar_index - 1])
+        else:
+            return None
+        first_cross = self.intrabar.first_cross(low_level, high_level, start_ns, end_ns)
+        if first_cross == UNRESOLVED:
+            return None
+        if (first_cross == LOW_FIRST) == isinstance(trade, Long):
+            return CLOSE_STOP_LOSS
+        return CLOSE_TAKE_PROFIT
+
+    def iter_bars(self):
+        if self.data_source is None:
+            yield 0, Bars(self.df)
+        else:
+            # the bars before the first one of the run are not read, e.g. those of the earlier folds of a walk forward
+            yield from self.data_source.iter_bars(self.lookback, self.index)
+
+    def process_bar(self, row):
+        # one step of the engine: the stop losses and take profits reached by the bar, then next(),
+        # the bar has to be the one at self.bar_index in self.bars
+        self.row = row
+        self.run_positions_take_profit_and_stop_loss()
+        if self.allow_same_row_exit:
+            positions_before = set(self.broker.positions)
+        self.next()
+        if self.allow_same_row_exit:
+            self.run_positions_take_profit_and_stop_loss(positions_before)
+        self.index += 1
+        self.bar_index += 1
+        self.previous_row = self.row
+
+    def get_state(self):
+        # snapshot of everything a run carries from one bar to the next: the broker with its positions and history,
+        # the position of the next bar, the previous row and the attributes of the strategy
+        previous_row = self.previous_row.detach() if isinstance(self.previous_row, Bar) else self.previous_row
+        attributes = {name: value for name, value in vars(self).items()
+                      if name not in self.state_excluded_attributes}
+        return self.copy_state({'broker': self.broker, 'previous_row': previous_row, 'attributes': attributes})
+
+    def copy_state(self, state):
+        # deep copy of a state, the history of the broker is copied without the unused capacity of its ledger,
+        # the backtest itself and the attributes that aren't part of the state (the data) are shared, so e.g. a
+        # callback bound to the backtest stays bound to it instead of to a copy of it
+        memo = {id(value): value for name, value in vars(self).items()
+                if name in self.state_excluded_attributes and name != 'broker'}
+        memo[id(self)] = self
+        history = state['broker'].history
+        memo[id(history)] = history.copy()
+        return copy.deepcopy(state, memo)
+
+    def set_state(self, state):
+        # the state is copied, so it can be restored more than once
+        state = self.copy_state(state)
+        self.__dict__.update(state['attributes'])
+        # keep the broker instance, the trades of the state refer to the exit books of the copied broker
+        self.broker.__dict__.update(state['broker'].__dict__)
+        self.previous_row = state['previous_row']
+
+    def run(self, start=-1, end=-1, state=None, save_state=False):
+        # with the state of a previous run, the run continues at the bar after the last one of that run instead of
+        # starting over, e.g. once new bars have been appended to the history,
+        # with save_state the state at the last bar (before the open positions are dropped) is kept in self.state
+        if state is None:
+            self.index = 0 if start == -1 else start
+            self.broker.reset()
+            self.start_dt = None
+        else:
+            assert start == -1, 'a run from a saved state continues where that state left off'
+            self.set_state(state)
+            start = self.run_start
+        self.run_start = start
+        if self.data_source is None:
+            end = self.get_run_end(end, len(self.df))
+        else:
+            assert self.columnar, 'streamed histories are only supported with columnar bars'
+            assert end == -1 or end > self.index
+        for position, self.bars in self.iter_bars():
+            self.bar_index = self.index - position
+            bar_end = len(self.bars) if end == -1 else min(end - position, len(self.bars))
+            if self.bar_index >= bar_end:
+                continue
+            # the exit book jumps ahead by positions in the bars, which start over with every chunk
+            self.broker.exit_book.invalidate()
+            if self.columnar:
+                get_row = self.bars.bar
+            else:
+                get_row = self.df.iloc.__getitem__
+            if self.start_dt is None:
+                self.start_dt = self.bars.index[self.bar_index]
+            while self.bar_index < bar_end:
+                self.process_bar(get_row(self.bar_index))
+            self.end_dt = self.bars.index[self.bar_index - 1]
+            if self.index == end:
+                break
+        assert self.start_dt is not None, 'no data to backtest'
+        if save_state:
+            self.state = self.get_state()
+        self.finish_run(start, end)
+
+    def get_run_end(self, end, n_bars):
+        # end of a run from self.index over a history of n_bars, -1 for all of it
+        end = n_bars if end == -1 else end
+        assert end > self.index
+        assert end <= n_bars
+        return end
+
+    def finish_run(self, start, end):
         if self.broker.positions:
             print(f'no data left to backtest, {len(self.broker.positions)} position{"s" if len(self.broker.positions) > 1 else ""} still open, '
                   f'pretend {"they" if len(self.broker.positions) > 1 else "it"} never existed')
             self.broker.undo_positions()
+        # the metrics are computed lazily when they are read, call stats.do_analysis() to compute them all at once
         self.stats = BacktestStats(self, start, end, self.resample_equity_timeframe)
-        self.stats.do_analysis()
+
+    def run_profiled(self, start=-1, end=-1, profiler=None):
+        # same as run, but records the time spent in each phase and counts bars and trades,
+        # returns the profiler, pass the profiler of a previous run to accumulate
+        profiler = profiler or Profiler()
+        return profiler.run(self, start, end)
+
+    def walk_forward(self, fold_size, start=-1, end=-1):
+        # runs the backtest in folds of fold_size bars, each continuing from the state of the previous one,
+        # returns the WalkForward driver, its update() runs bars appended to the history later on
+        walk_forward = WalkForward(self)
+        walk_forward.run(fold_size, start, end)
+        return walk_forward
+
+    def run_cached(self, cache, start=-1, end=-1):
+        # same as run, but an identical run (same history, strategy, parameters and broker settings) is loaded from
+        # the ResultCache instead, returns whether it was
+        return cache.run(self, start, end)
+
+    def optimize(self, param_grid, metric='return_perc', maximize=True, n_jobs=None, method='grid', n_iter=None,
+                 random_state=None, start=-1, end=-1, eta=3, min_bars=1000, metrics=DEFAULT_METRICS, cache=None):
+        # runs copies of this backtest for the parameter combinations of param_grid (attribute name -> values)
+        # on a process pool and returns a table of the stats metrics ranked by metric,
+        # method is either 'grid', 'random' (n_iter samples) or 'halving' (successive halving over growing data),
+        # with multiple jobs the subclass has to be importable by the workers (defined at module level),
+        # with a ResultCache the runs of a previous (e.g. crashed) sweep are not repeated
+        optimizer = Optimizer(self, metric, metrics, maximize, n_jobs, cache)
+        return optimizer.optimize(param_grid, method, n_iter, random_state, start, end, eta, min_bars)
@@ -1,7 +1,9 @@
-from datetime import timedelta
+from functools import cached_property
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
+
+from .bar import get_index_ns
 
 
 def make_table_str(table):
@@ -19,23 +21,75 @@ class BacktestStats:
         self.resample_equity_timeframe = resample_equity_timeframe
         self.backtest = backtest
         self.start = 0 if start == -1 else start
-        self.end = len(backtest.df) if end == -1 else end
-        self.period = None
-        self.win_rate = None
-        self.equity_trades_profit_df = None
-        self.equity_trades_profit_fig = None
-        self.min_equity = None
-        self.max_equity = None
-        self.return_perc = None
-        self.av_trade_duration = None
-        self.min_trade_duration = None
-        self.max_trade_duration = None
-        self.av_profit_per_trade = None
+        if end == -1:
+            # a streamed history has no length up front, the backtest stops at its last bar
+            end = backtest.index if backtest.df is None else len(backtest.df)
+        self.end = end
+
+    # every metric is computed on first access and cached, a run only pays for the metrics that are read
+
+    @cached_property
+    def profits(self):
+        # realized profit of every closed trade, taken from the columns of the trade ledger
+        return self.backtest.broker.history.get_profits()
+
+    @cached_property
+    def durations(self):
+        # duration of every closed trade in nanoseconds
+        return self.backtest.broker.history.get_durations_ns()
+
+    @cached_property
+    def period(self):
+        return self.get_period()
+
+    @cached_property
+    def win_rate(self):
+        return self.calc_win_rate()
+
+    @cached_property
+    def equity_trades_profit_df(self):
+        return self.get_equity_trades_profit_df()
+
+    @cached_property
+    def equity_trades_profit_fig(self):
+        return self.get_equity_trades_profit_fig()
+
+    @cached_property
+    def final_equity(self):
+        return self.get_final_equity()
+
+    @cached_property
+    def min_equity(self):
+        return self.get_min_equity()
+
+    @cached_property
+    def max_equity(self):
+        return self.get_max_equity()
+
+    @cached_property
+    def return_perc(self):
+        return self.get_return_perc()
+
+    @cached_property
+    def av_trade_duration(self):
+        return self.get_av_trade_duration()
+
+    @cached_property
+    def min_trade_duration(self):
+        return self.get_min_trade_duration()
+
+    @cached_property
+    def max_trade_duration(self):
+        return self.get_max_trade_duration()
+
+    @cached_property
+    def av_profit_per_trade(self):
+        return self.get_av_profit_per_trade()
 
     def __str__(self):
         return make_table_str([
             ('Period', 'N/A' if self.period is None else str(self.period.round('1s'))),
-            ('Final Equity', str(round(self.backtest.broker.equity, 2))),
+            ('Final Equity', str(round(self.final_equity, 2))),
             ('Min Equity', 'N/A' if self.min_equity is None else str(round(self.min_equity, 2))),
             ('Max Equity', 'N/A' if self.max_equity is None else str(round(self.max_equity, 2))),
             ('Return [%]', 'N/A' if self.return_perc is None else str(round(self.return_perc * 100, 2))),
@@ -47,50 +101,66 @@ class BacktestStats:
             ('Avg. Profit Per Trade', 'N/A' if self.av_profit_per_trade is None else str(round(self.av_profit_per_trade, 2)))
         ])
 
-    def do_analysis(self):
-        self.period = self.get_period()
-        self.win_rate = self.calc_win_rate()
-        self.equity_trades_profit_df = self.get_equity_trades_profit_df()
-        self.equity_trades_profit_fig = self.get_equity_trades_profit_fig()
-        self.min_equity = self.get_min_equity()
-        self.max_equity = self.get_max_equity()
-        self.return_perc = self.get_return_perc()
-        self.av_trade_duration = self.get_av_trade_duration()
-        self.min_trade_duration = self.get_min_trade_duration()
-        self.max_trade_duration = self.get_max_trade_duration()
-        self.av_profit_per_trade = self.get_av_profit_per_trade()
+    def do_analysis(self, fig=False):
+        # compute all metrics up front, the figure only if asked for
+        names = ['period', 'win_rate', 'equity_trades_profit_df', 'final_equity', 'min_equity', 'max_equity',
+                 'return_perc', 'av_trade_duration', 'min_trade_duration', 'max_trade_duration', 'av_profit_per_trade']
+        if fig:
+            names.append('equity_trades_profit_fig')
+        for name in names:
+            getattr(self, name)
 
     def get_period(self):
-        return self.backtest.df.index[self.end - 1] - self.backtest.df.index[self.start]
+        return self.backtest.end_dt - self.backtest.start_dt
 
     def calc_win_rate(self):
-        if not self.backtest.broker.history:
+        if not len(self.profits):
             return
-        win_counter = 0
-        for trade in self.backtest.broker.history:
-            if trade.calc_profit() > 0:
-                win_counter += 1
-        return win_counter / len(self.backtest.broker.history)
+        return np.count_nonzero(self.profits > 0) / len(self.profits)
 
     def get_equity_trades_profit_df(self):
+        if self.backtest.df is None:
+            return self.get_streamed_equity_trades_profit_df()
         df = pd.DataFrame()
         df['Datetime'] = self.backtest.df.iloc[self.start:self.end].index
-        equity = [self.backtest.broker.initial_equity]
-        for trade in self.backtest.broker.history:
-            i = self.backtest.df.index.get_loc(trade.close_dt) - self.start
-            if len(equity) <= i:
-                equity.extend([equity[-1]] * (i - len(equity) + 1))
-            equity[i] += trade.calc_profit()
-        if len(equity) < len(df):
-            equity.extend([equity[-1]] * (len(df) - len(equity)))
-        df['Equity'] = equity
+        # add the profit of each trade to the bar it was closed on, the equity is the running sum of it
+        close_dts = self.backtest.broker.history.records['close_dt']
+        close_indexes = np.searchsorted(get_index_ns(self.backtest.df.index), close_dts) - self.start
+        profits = np.bincount(close_indexes, weights=self.profits, minlength=len(df))
+        df['Equity'] = self.backtest.broker.initial_equity + np.cumsum(profits)
+        return df
+
+    def get_streamed_equity_trades_profit_df(self):
+        # the bars of a streamed history are gone, the equity only changes when trades are closed though,
+        # so it is given at the first and last bar and at every bar trades were closed on, like the equity
+        # on a dataframe it holds the profits of all trades closed on a bar, which keeps min and max equity exact
+        close_dts = self.backtest.broker.history.records['close_dt']
+        order = np.argsort(close_dts, kind='stable')
+        datetimes, starts = np.unique(close_dts[order], return_index=True)
+        profits = np.add.reduceat(self.profits[order], starts) if len(starts) else np.empty(0)
+        start_ns = pd.Timestamp(self.backtest.start_dt).value
+        end_ns = pd.Timestamp(self.backtest.end_dt).value
+        if not len(datetimes) or datetimes[0] != start_ns:
+            datetimes = np.concatenate(([start_ns], datetimes))
+            profits = np.concatenate(([0], profits))
+        if datetimes[-1] != end_ns:
+            datetimes = np.concatenate((datetimes, [end_ns]))
+            profits = np.concatenate((profits, [0]))
+        df = pd.DataFrame()
+        df['Datetime'] = pd.DatetimeIndex(datetimes.view('datetime64[ns]'))
+        if self.backtest.start_dt.tz is not None:
+            df['Datetime'] = df['Datetime'].dt.tz_localize('UTC').dt.tz_convert(self.backtest.start_dt.tz)
+        df['Equity'] = self.backtest.broker.initial_equity + np.cumsum(profits)
         return df
 
     def get_equity_trades_profit_fig(self):
+        import plotly.express as px
         if self.resample_equity_timeframe:
             df = self.equity_trades_profit_df.copy()
             df.set_index('Datetime', inplace=True)
             df = df.resample(self.resample_equity_timeframe).agg({'Equity': 'last'})
+            if self.backtest.df is None:
+                df = df.ffill()
             df.reset_index(inplace=True)
             return px.line(df, x='Datetime', y="Equity")
         else:
@@ -102,41 +172,29 @@ class BacktestStats:
     def get_max_equity(self):
         return self.equity_trades_profit_df.Equity.max()
 
+    def get_final_equity(self):
+        # realized, like the equity curve, positions still open (e.g. at the end of a live run) don't count
+        return self.backtest.broker.realized_equity
+
     def get_return_perc(self):
-        return (self.backtest.broker.equity - self.backtest.broker.initial_equity) / self.backtest.broker.initial_equity
+        return (self.final_equity - self.backtest.broker.initial_equity) / self.backtest.broker.initial_equity
 
     def get_av_trade_duration(self):
-        if not self.backtest.broker.history:
+        if not len(self.durations):
             return
-        total_duration = timedelta()
-        for trade in self.backtest.broker.history:
-            total_duration += trade.get_duration()
-        return total_duration / len(self.backtest.broker.history)
+        return pd.Timedelta(int(self.durations.sum()), 'ns') / len(self.durations)
 
     def get_min_trade_duration(self):
-        if not self.backtest.broker.history:
+        if not len(self.durations):
             return
-        min_duration = self.backtest.broker.history[0].get_duration()
-        for trade in self.backtest.broker.history[1:]:
-            duration = trade.get_duration()
-            if duration < min_duration:
-                min_duration = duration
-        return min_duration
+        return pd.Timedelta(int(self.durations.min()), 'ns')
 
     def get_max_trade_duration(self):
-        if not self.backtest.broker.history:
+        if not len(self.durations):
             return
-        max_duration = self.backtest.broker.history[0].get_duration()
-        for trade in self.backtest.broker.history[1:]:
-            duration = trade.get_duration()
-            if duration > max_duration:
-                max_duration = duration
-        return max_duration
+        return pd.Timedelta(int(self.durations.max()), 'ns')
 
     def get_av_profit_per_trade(self):
-        if not self.backtest.broker.history:
+        if not len(self.profits):
             return
-        total_profit = 0
-        for trade in self.backtest.broker.history:
-            total_profit += trade.calc_profit()
-        return total_profit / len(self.backtest.broker.history)
+        return self.profits.sum() / len(self.profits)
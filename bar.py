@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def get_index_ns(index):
+    # int64 nanoseconds since epoch (utc) of a datetime index, whatever unit it is stored in
+    return index.as_unit('ns').asi8 if hasattr(index, 'as_unit') else index.asi8
+
+
+class Bars:
+    def __init__(self, df):
+        self.set_columns({column: df[column].to_numpy() for column in df.columns}, df.index)
+
+    @classmethod
+    def from_columns(cls, columns, index):
+        bars = cls.__new__(cls)
+        bars.set_columns(columns, index)
+        return bars
+
+    def set_columns(self, columns, index):
+        self.columns = columns
+        self.index = index
+        self.Open = self.columns['Open']
+        self.High = self.columns['High']
+        self.Low = self.columns['Low']
+        self.Close = self.columns['Close']
+
+    def tail(self, n):
+        start = max(len(self) - n, 0)
+        return Bars.from_columns({column: values[start:] for column, values in self.columns.items()},
+                                 self.index[start:])
+
+    def concat(self, other):
+        return Bars.from_columns({column: np.concatenate((values, other.columns[column]))
+                                  for column, values in self.columns.items()}, self.index.append(other.index))
+
+    def __len__(self):
+        return len(self.index)
+
+    def bar(self, i):
+        return Bar(self, i)
+
+
+class Bar:
+    # lightweight stand-in for the row series returned by df.iloc, only the ohlc values are materialized up front,
+    # the name (timestamp) and every other column are looked up on access
+    __slots__ = ('_bars', '_i', '_name', 'Open', 'High', 'Low', 'Close')
+
+    def __init__(self, bars, i):
+        self._bars = bars
+        self._i = i
+        self._name = None
+        self.Open = bars.Open[i]
+        self.High = bars.High[i]
+        self.Low = bars.Low[i]
+        self.Close = bars.Close[i]
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = self._bars.index[self._i]
+        return self._name
+
+    def __getattr__(self, item):
+        # private and special names are never columns, copy and pickle look them up before _bars is set
+        if item.startswith('_'):
+            raise AttributeError(item)
+        try:
+            return self._bars.columns[item][self._i]
+        except KeyError:
+            raise AttributeError(item) from None
+
+    def __getitem__(self, item):
+        return self._bars.columns[item][self._i]
+
+    def detach(self):
+        # the same bar on bars of its own, so it doesn't keep all the bars it was taken from alive
+        i = self._i
+        return Bars.from_columns({column: values[i:i + 1].copy() for column, values in self._bars.columns.items()},
+                                 self._bars.index[i:i + 1]).bar(0)
+
+    def __repr__(self):
+        return f'Bar(name={self.name!r}, Open={self.Open}, High={self.High}, Low={self.Low}, Close={self.Close})'
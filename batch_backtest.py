@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+
+from .bar import get_index_ns
+from .broker import Broker
+from .broker_calcs import *
+
+
+def to_configs(values, n_bars, n_configs, dtype=float):
+    # per bar and configuration values, a 1-d array is shared by all configurations
+    values = np.asarray(values, dtype=dtype)
+    if values.ndim == 0:
+        return np.full((n_bars, n_configs), values)
+    if values.ndim == 1:
+        return np.broadcast_to(values[:, None], (n_bars, n_configs))
+    return values
+
+
+def to_config_values(values, n_configs, dtype=float):
+    # one value per configuration, a scalar is shared by all configurations
+    return np.broadcast_to(np.asarray(values, dtype=dtype), (n_configs,)).copy()
+
+
+class BatchSignalBacktest:
+    # runs n configurations of the signal strategy of SignalBacktest side by side in a single pass over the bars,
+    # signals and levels have a column per configuration (2-d) or are shared (1-d), side, total, leverage and the
+    # broker (fees and initial equity) may differ per configuration, every configuration holds at most one
+    # position, the positions live in arrays indexed by configuration and the broker math runs on all of them at once
+    def __init__(self,
+                 df,
+                 entries,
+                 exits=None,
+                 stop_loss=None,
+                 take_profit=None,
+                 short=False,
+                 total=100,
+                 leverage=1,
+                 brokers=None,
+                 enforce_stop_loss_first=True,
+                 allow_same_row_exit=False):
+        self.df = df
+        n_bars = len(df)
+        shapes = [np.shape(values) for values in (entries, exits, stop_loss, take_profit) if values is not None]
+        n_configs = max([shape[1] for shape in shapes if len(shape) == 2] +
+                        [np.size(values) for values in (short, total, leverage)] + [len(brokers or ())] + [1])
+        self.n_configs = n_configs
+        self.entries = to_configs(entries, n_bars, n_configs, bool)
+        self.exits = to_configs(False if exits is None else exits, n_bars, n_configs, bool)
+        self.stop_loss = to_configs(np.nan if stop_loss is None else stop_loss, n_bars, n_configs)
+        self.take_profit = to_configs(np.nan if take_profit is None else take_profit, n_bars, n_configs)
+        self.short = to_config_values(short, n_configs, bool)
+        self.total = to_config_values(total, n_configs)
+        self.leverage = to_config_values(leverage, n_configs)
+        brokers = brokers or [Broker()]
+        if len(brokers) == 1:
+            brokers = brokers * n_configs
+        assert len(brokers) == n_configs
+        self.initial_equity = np.array([broker.initial_equity for broker in brokers], dtype=float)
+        self.maker_fee = np.array([broker.maker_fee for broker in brokers], dtype=float)
+        self.taker_fee = np.array([broker.taker_fee for broker in brokers], dtype=float)
+        self.margin_opening_fee = np.array([broker.symbol_a_margin_opening_fee for broker in brokers], dtype=float)
+        self.margin_rollover_fee = np.array([broker.symbol_a_margin_rollover_fee[0] for broker in brokers], dtype=float)
+        self.rollover_period_ns = np.array([broker.rollover_period_ns for broker in brokers], dtype=np.int64)
+        self.enforce_stop_loss_first = enforce_stop_loss_first
+        self.allow_same_row_exit = allow_same_row_exit
+        self.results = None
+        self.reset()
+
+    def reset(self):
+        n = self.n_configs
+        # open position of every configuration
+        self.is_open = np.zeros(n, dtype=bool)
+        self.position_short = np.zeros(n, dtype=bool)
+        self.position_leverage = np.ones(n)
+        self.leveraged_quantity = np.zeros(n)
+        self.leveraged_total_bought = np.zeros(n)
+        self.leveraged_total_sold = np.zeros(n)
+        self.open_ns = np.zeros(n, dtype=np.int64)
+        self.position_stop_loss = np.full(n, np.nan)
+        self.position_take_profit = np.full(n, np.nan)
+        # results of every configuration, equity is kept like Broker.equity does and the equity curve like
+        # BacktestStats does, as the running sum of the profits of the closed trades
+        self.equity = self.initial_equity.copy()
+        self.profit = np.zeros(n)
+        self.min_equity = np.full(n, np.inf)
+        self.max_equity = np.full(n, -np.inf)
+        self.trades = np.zeros(n, dtype=np.int64)
+        self.wins = np.zeros(n, dtype=np.int64)
+        self.duration_ns = np.zeros(n, dtype=np.int64)
+        self.min_duration_ns = np.full(n, np.iinfo(np.int64).max)
+        self.max_duration_ns = np.zeros(n, dtype=np.int64)
+
+    def open_positions(self, mask, i, price, time_ns):
+        configs = np.flatnonzero(mask)
+        if not len(configs):
+            return
+        short = self.short[configs]
+        leverage = self.leverage[configs]
+        fee = self.taker_fee[configs]
+        leveraged_total = self.total[configs] * leverage
+        # same math as Broker.open_long and Broker.open_short
+        long_quantity = calc_quantity(price, lower_value_with_fee(leveraged_total, fee))
+        short_quantity = calc_quantity(price, leveraged_total)
+        short_total_sold = calc_total(price, lower_value_with_fee(short_quantity, fee))
+        self.is_open[configs] = True
+        self.position_short[configs] = short
+        self.position_leverage[configs] = leverage
+        self.leveraged_quantity[configs] = np.where(short, short_quantity, long_quantity)
+        self.leveraged_total_bought[configs] = np.where(short, np.nan, leveraged_total)
+        self.leveraged_total_sold[configs] = np.where(short, short_total_sold, np.nan)
+        self.open_ns[configs] = time_ns
+        self.position_stop_loss[configs] = self.stop_loss[i, configs]
+        self.position_take_profit[configs] = self.take_profit[i, configs]
+        self.equity[configs] -= np.where(short, 0, self.total[configs])
+
+    def close_positions(self, mask, prices, fees, time_ns):
+        configs = np.flatnonzero(mask)
+        if not len(configs):
+            return
+        prices = prices[configs] if np.ndim(prices) else prices
+        fees = fees[configs]
+        short = self.position_short[configs]
+        quantity = self.leveraged_quantity[configs]
+        # same math as Broker.close_long
+        long_total_sold = calc_total(prices, lower_value_with_fee(quantity, fees))
+        # same math as Broker.close_short
+        borrowed_quantity = quantity / self.position_leverage[configs]
+        margin_fee = calc_margin_fee_ns(time_ns - self.open_ns[configs], self.margin_opening_fee[configs],
+                                        self.margin_rollover_fee[configs], self.rollover_period_ns[configs])
+        borrowed_quantity_with_fee = increase_value_with_fee(borrowed_quantity, margin_fee)
+        quantity_settle = quantity + borrowed_quantity_with_fee - borrowed_quantity
+        short_total_bought = calc_total_for_quantity(prices, quantity_settle, fees)
+        sold = np.where(short, self.leveraged_total_sold[configs], long_total_sold)
+        bought = np.where(short, short_total_bought, self.leveraged_total_bought[configs])
+        profit = sold - bought
+        duration_ns = time_ns - self.open_ns[configs]
+        self.equity[configs] += np.where(short, profit, bought / self.position_leverage[configs] + profit)
+        self.profit[configs] += profit
+        self.trades[configs] += 1
+        self.wins[configs] += profit > 0
+        self.duration_ns[configs] += duration_ns
+        self.min_duration_ns[configs] = np.minimum(self.min_duration_ns[configs], duration_ns)
+        self.max_duration_ns[configs] = np.maximum(self.max_duration_ns[configs], duration_ns)
+        self.is_open[configs] = False
+
+    def run_take_profit_and_stop_loss(self, mask, open_, high, low, previous_close, time_ns):
+        # returns whether any position was closed
+        # vectorized version of Backtest.run_positions_take_profit_and_stop_loss for one position per configuration
+        short = self.position_short
+        stop_loss, take_profit = self.position_stop_loss, self.position_take_profit
+        # nan levels never compare true
+        stop_loss_hit = np.where(short, high >= stop_loss, low <= stop_loss)
+        take_profit_hit = np.where(short, low <= take_profit, high >= take_profit)
+        mask = mask & (stop_loss_hit | take_profit_hit)
+        if not mask.any():
+            return False
+        if self.enforce_stop_loss_first:
+            stop_loss_first = np.ones(len(short), dtype=bool)
+            gap = np.zeros(len(short), dtype=bool)
+        else:
+            open_gone_down = previous_close is not None and open_ < previous_close
+            open_gone_up = previous_close is not None and open_ > previous_close
+            gap = np.where(short, open_gone_up & (open_ >= stop_loss), open_gone_down & (open_ <= stop_loss))
+            # the take profit goes first if the bar opened at its low (long) or its high (short)
+            stop_loss_first = np.where(short, open_ != high, open_ != low)
+        stop_loss_close = mask & (gap | (stop_loss_hit & (stop_loss_first | ~take_profit_hit)))
+        take_profit_close = mask & ~stop_loss_close & take_profit_hit
+        self.close_positions(stop_loss_close, stop_loss, self.maker_fee, time_ns)
+        self.close_positions(take_profit_close, take_profit, self.maker_fee, time_ns)
+        return True
+
+    def update_equity_range(self):
+        equity = self.initial_equity + self.profit
+        np.minimum(self.min_equity, equity, out=self.min_equity)
+        np.maximum(self.max_equity, equity, out=self.max_equity)
+
+    def run(self, start=-1, end=-1):
+        start = 0 if start == -1 else start
+        end = len(self.df) if end == -1 else end
+        assert end > start
+        assert end <= len(self.df)
+        self.reset()
+        opens = self.df['Open'].to_numpy()
+        highs = self.df['High'].to_numpy()
+        lows = self.df['Low'].to_numpy()
+        closes = self.df['Close'].to_numpy()
+        times = get_index_ns(self.df.index)
+        # bars on which any configuration may do something without an open position
+        signal_bars = self.entries[start:end].any(axis=1)
+        previous_close = None
+        for i in range(start, end):
+            open_, high, low, close, time_ns = opens[i], highs[i], lows[i], closes[i], times[i]
+            changed = i == start
+            if self.is_open.any():
+                changed |= self.run_take_profit_and_stop_loss(self.is_open, open_, high, low, previous_close,
+                                                              time_ns)
+            if signal_bars[i - start] or self.is_open.any():
+                exit_mask = self.is_open & self.exits[i]
+                entry_mask = ~self.is_open & self.entries[i]
+                if exit_mask.any():
+                    self.close_positions(exit_mask, close, self.taker_fee, time_ns)
+                    changed = True
+                if entry_mask.any():
+                    self.open_positions(entry_mask, i, close, time_ns)
+                    if self.allow_same_row_exit:
+                        changed |= self.run_take_profit_and_stop_loss(entry_mask, open_, high, low, previous_close,
+                                                                      time_ns)
+            # the equity curve only moves when trades are closed
+            if changed:
+                self.update_equity_range()
+            previous_close = close
+        # positions still open at the end are dropped as if they never existed, like Backtest does
+        undo = self.is_open & ~self.position_short
+        self.equity[undo] += self.leveraged_total_bought[undo] / self.position_leverage[undo]
+        self.is_open[:] = False
+        self.results = self.get_results()
+        return self.results
+
+    def get_results(self):
+        # one row per configuration with the metrics of BacktestStats, nan (NaT) where there are no trades
+        has_trades = self.trades > 0
+        trades = np.maximum(self.trades, 1)
+
+        def to_durations(durations_ns):
+            return pd.Series(pd.to_timedelta(np.where(has_trades, durations_ns, 0), 'ns')).where(has_trades)
+
+        return pd.DataFrame({
+            'final_equity': self.equity,
+            'min_equity': self.min_equity,
+            'max_equity': self.max_equity,
+            'return_perc': (self.equity - self.initial_equity) / self.initial_equity,
+            'win_rate': np.where(has_trades, self.wins / trades, np.nan),
+            'av_trade_duration': to_durations(self.duration_ns / trades),
+            'min_trade_duration': to_durations(self.min_duration_ns),
+            'max_trade_duration': to_durations(self.max_duration_ns),
+            'trades': self.trades,
+            'av_profit_per_trade': np.where(has_trades, self.profit / trades, np.nan)
+        })
@@ -0,0 +1,134 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import tracemalloc
+
+from ..broker import Broker
+from .strategies import STRATEGIES
+from .synthetic import GENERATORS
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'golden.json')
+GOLDEN_SIZE = 10_000
+SEED = 42
+# relative tolerance when comparing against the golden results, fills and equity have to stay the same
+TOLERANCE = 1e-9
+
+
+def time_backtest(strategy, df):
+    # seconds of a plain run and of computing its stats, the profiled run would time its own instrumentation too
+    backtest = strategy(df, Broker(), **strategy.backtest_kwargs)
+    # silence the note about positions still open at the end of the data
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        backtest.run()
+        run_time = time.perf_counter() - start
+    start = time.perf_counter()
+    backtest.stats.do_analysis()
+    return run_time, time.perf_counter() - start
+
+
+def run_backtest(strategy, df):
+    # profiled, for the stop loss and take profit hits of the golden results
+    backtest = strategy(df, Broker(), **strategy.backtest_kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        profiler = backtest.run_profiled()
+    return backtest, profiler
+
+
+def get_result(backtest, profiler):
+    stats = backtest.stats
+    return {
+        'trades': len(backtest.broker.history),
+        'stop_loss_hits': profiler.stop_loss_hits,
+        'take_profit_hits': profiler.take_profit_hits,
+        'final_equity': float(backtest.broker.equity),
+        'min_equity': float(stats.min_equity),
+        'max_equity': float(stats.max_equity),
+        'total_profit': float(stats.profits.sum())
+    }
+
+
+def measure_peak_memory(strategy, df):
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            strategy(df, Broker(), **strategy.backtest_kwargs).run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(generator_name, strategy_name, size, memory=True, check_golden=True):
+    strategy = STRATEGIES[strategy_name]
+    df = strategy.prepare(GENERATORS[generator_name](size, SEED))
+    run_time, stats_time = time_backtest(strategy, df)
+    return {
+        'generator': generator_name,
+        'strategy': strategy_name,
+        'bars': len(df),
+        'bars_per_sec': len(df) / run_time,
+        'stats_time': stats_time,
+        'peak_memory_mb': measure_peak_memory(strategy, df) / 2 ** 20 if memory else None,
+        'result': get_result(*run_backtest(strategy, df)) if check_golden else None
+    }
+
+
+def compare(result, golden):
+    mismatches = []
+    for key, expected in golden.items():
+        actual = result[key]
+        if abs(actual - expected) > TOLERANCE * max(abs(expected), 1):
+            mismatches.append(f'{key}: expected {expected}, got {actual}')
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the backtest engine on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6])
+    parser.add_argument('--generators', nargs='+', default=list(GENERATORS), choices=list(GENERATORS))
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) peak memory measurement')
+    parser.add_argument('--update-golden', action='store_true', help=f'store the results for {GOLDEN_SIZE} bars')
+    parser.add_argument('--output', help='write the results as json to this path')
+    args = parser.parse_args()
+
+    with open(GOLDEN_PATH) as f:
+        golden = json.load(f)
+    sizes = sorted(set(args.sizes) | ({GOLDEN_SIZE} if args.update_golden else set()))
+    results = []
+    failed = False
+    print(f'{"generator":<24} {"strategy":<20} {"bars":>10} {"bars/s":>12} {"stats [s]":>10} {"peak [MB]":>10}  golden')
+    for generator_name in args.generators:
+        for strategy_name in args.strategies:
+            for size in sizes:
+                key = f'{generator_name}/{strategy_name}'
+                check_golden = size == GOLDEN_SIZE and (args.update_golden or key in golden)
+                result = run_scenario(generator_name, strategy_name, size, not args.no_memory, check_golden)
+                results.append(result)
+                check = '-'
+                if check_golden:
+                    if args.update_golden:
+                        golden[key] = result['result']
+                        check = 'updated'
+                    elif key in golden:
+                        mismatches = compare(result['result'], golden[key])
+                        check = 'ok' if not mismatches else 'MISMATCH ' + '; '.join(mismatches)
+                        failed |= bool(mismatches)
+                peak = 'n/a' if result['peak_memory_mb'] is None else f'{result["peak_memory_mb"]:.1f}'
+                print(f'{generator_name:<24} {strategy_name:<20} {size:>10} {result["bars_per_sec"]:>12,.0f} '
+                      f'{result["stats_time"]:>10.4f} {peak:>10}  {check}')
+    if args.update_golden:
+        with open(GOLDEN_PATH, 'w') as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        raise SystemExit('results differ from the golden results')
+
+
+if __name__ == '__main__':
+    main()
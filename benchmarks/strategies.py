@@ -0,0 +1,101 @@
+import numpy as np
+
+from ..backtest import Backtest
+
+
+class FewTrades(Backtest):
+    # long while the fast moving average is above the slow one, no stop loss or take profit
+    backtest_kwargs = {}
+    fast = 50
+    slow = 200
+
+    @classmethod
+    def prepare(cls, df):
+        df = df.copy()
+        df['Trend'] = (df['Close'].rolling(cls.fast).mean() > df['Close'].rolling(cls.slow).mean()).astype(int)
+        return df
+
+    def next(self):
+        if self.row.Trend and not self.broker.positions:
+            self.broker.open_long(self.row.Close, 500, self.row.name, self.broker.taker_fee)
+        elif not self.row.Trend and self.broker.positions:
+            for trade in list(self.broker.positions):
+                self.broker.close_trade(self.row.Close, trade, self.row.name, self.broker.taker_fee)
+
+
+class ManyPositions(Backtest):
+    # alternately opens longs and shorts every few bars, all of them closed by their stop loss or take profit,
+    # which are resolved with the open gap and open is low/high rules and may hit on the bar they are opened on
+    backtest_kwargs = {'enforce_stop_loss_first': False, 'allow_same_row_exit': True}
+    every = 3
+    max_positions = 200
+    stop_loss = 0.01
+    take_profit = 0.015
+
+    @classmethod
+    def prepare(cls, df):
+        return df
+
+    def next(self):
+        if self.index % self.every or len(self.broker.positions) >= self.max_positions:
+            return
+        price = self.row.Close
+        if self.index // self.every % 2:
+            self.broker.open_long(price, 2, self.row.name, self.broker.taker_fee, 2,
+                                  price * (1 - self.stop_loss), price * (1 + self.take_profit))
+        else:
+            self.broker.open_short(price, 2, self.row.name, self.broker.taker_fee, 2,
+                                   price * (1 + self.stop_loss), price * (1 - self.take_profit))
+
+
+class ShortMarginHeavy(Backtest):
+    # leveraged shorts held for a long time, so most of the work is margin fee accounting on the closes
+    backtest_kwargs = {}
+    every = 5
+    hold = 600
+    max_positions = 500
+
+    @classmethod
+    def prepare(cls, df):
+        return df
+
+    def next(self):
+        if self.index % self.every == 0 and len(self.broker.positions) < self.max_positions:
+            price = self.row.Close
+            self.broker.open_short(price, 1, self.row.name, self.broker.taker_fee, 3, price * 1.05, price * 0.95)
+        if self.index % self.hold == 0:
+            for trade in list(self.broker.positions):
+                self.broker.close_trade(self.row.Close, trade, self.row.name, self.broker.taker_fee)
+
+
+class MissingLevels(Backtest):
+    # longs with a stop loss from an indicator that is often nan (no level) next to longs with a stop loss and a
+    # take profit, the nan levels must not keep the other positions from being closed
+    backtest_kwargs = {}
+    every = 4
+    window = 20
+    hold = 500
+
+    @classmethod
+    def prepare(cls, df):
+        df = df.copy()
+        stop_loss = df['Low'].rolling(cls.window).min() * 0.995
+        df['StopLoss'] = stop_loss.where(np.arange(len(df)) % 7 != 0)
+        return df
+
+    def next(self):
+        price = self.row.Close
+        if self.index % self.every == 0:
+            self.broker.open_long(price, 2, self.row.name, self.broker.taker_fee, 1, self.row.StopLoss)
+            self.broker.open_long(price, 2, self.row.name, self.broker.taker_fee, 1, price * 0.99, price * 1.01)
+        if self.index % self.hold == 0:
+            for trade in list(self.broker.positions):
+                self.broker.close_trade(price, trade, self.row.name, self.broker.taker_fee)
+
+
+STRATEGIES = {
+    'few_trades': FewTrades,
+    'many_positions': ManyPositions,
+    'short_margin_heavy': ShortMarginHeavy,
+    'missing_levels': MissingLevels
+}
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+
+def random_walk(n, seed=0, freq='1min', start='2020-01-01', volatility=0.001, spread=0.0005):
+    # geometric random walk, every bar opens at the close of the bar before
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, volatility, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, spread, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, spread, n)))
+    index = pd.date_range(start, periods=n, freq=freq)
+    return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close}, index=index)
+
+
+def gappy(n, seed=0, freq='1min', start='2020-01-01', gap_probability=0.01, gap_size=0.01, missing_probability=0.05):
+    # random walk with price gaps between the close and the next open and with missing bars in the timeline
+    rng = np.random.default_rng(seed)
+    df = random_walk(n, seed, freq, start)
+    gaps = np.where(rng.random(n) < gap_probability, rng.normal(0, gap_size, n), 0)
+    factor = np.exp(np.cumsum(gaps))
+    # the gap is applied from the open of a bar on, the close of the bar before stays where it was
+    for column in ('Open', 'High', 'Low', 'Close'):
+        df[column] *= factor
+    keep = rng.random(n) >= missing_probability
+    keep[0] = True
+    return df[keep]
+
+
+def open_equals_low_or_high(n, seed=0, freq='1min', start='2020-01-01', share=0.3):
+    # random walk where a share of the bars opens at its low and another share at its high
+    rng = np.random.default_rng(seed)
+    df = random_walk(n, seed, freq, start)
+    kind = rng.random(n)
+    at_low = kind < share / 2
+    at_high = (kind >= share / 2) & (kind < share)
+    df.loc[at_low, 'Low'] = df.loc[at_low, 'Open']
+    df.loc[at_high, 'High'] = df.loc[at_high, 'Open']
+    return df
+
+
+GENERATORS = {
+    'random_walk': random_walk,
+    'gappy': gappy,
+    'open_equals_low_or_high': open_equals_low_or_high
+}
@@ -1,5 +1,9 @@
+import numpy as np
+
 from .broker_calcs import *
-from .trade import Long, Short
+from .exit_book import ExitBook
+from .ledger import Positions, TradeLedger, to_ns
+from .trade import Long, Short, CLOSE_MANUAL
 
 
 class Broker:
@@ -18,10 +22,79 @@ class Broker:
         self.taker_fee = taker_fee
         self.symbol_a_margin_opening_fee = symbol_a_margin_opening_fee
         self.symbol_a_margin_rollover_fee = symbol_a_margin_rollover_fee
-        self.positions = positions or []
-        self.history = history or []
+        self.positions = Positions()
+        self.history = TradeLedger(history)
+        # open positions and their exit book per symbol, trades opened without a symbol are kept under None
+        self.symbol_positions = {}
+        self.exit_books = {}
+        for trade in positions or ():
+            self.add_position(trade)
+
+    @property
+    def symbol_a_margin_rollover_fee(self):
+        return self._symbol_a_margin_rollover_fee
+
+    @symbol_a_margin_rollover_fee.setter
+    def symbol_a_margin_rollover_fee(self, rollover_fee):
+        # the rollover period is kept in nanoseconds, margin fees are computed on int64 timestamps
+        self._symbol_a_margin_rollover_fee = rollover_fee
+        self.rollover_period_ns = hours_to_ns(rollover_fee[1])
+
+    def calc_margin_fee_for_duration_ns(self, duration_ns):
+        # duration_ns may be an array, e.g. the durations of several shorts closed at the same time
+        return calc_margin_fee_ns(duration_ns, self.symbol_a_margin_opening_fee, self.symbol_a_margin_rollover_fee[0],
+                                  self.rollover_period_ns)
+
+    def get_margin_fees(self, shorts, close_dt):
+        # margin fees of several shorts closed at the same time in one go
+        open_ns = np.fromiter((to_ns(short.open_dt) for short in shorts), np.int64, len(shorts))
+        return self.calc_margin_fee_for_duration_ns(to_ns(close_dt) - open_ns).tolist()
+
+    @property
+    def realized_equity(self):
+        # the equity without the capital tied up in the open longs, i.e. as if the open positions had never been
+        # opened, equal to the equity once a backtest has dropped them at its end
+        return self.equity + sum(trade.leveraged_total_bought / trade.leverage
+                                 for trade in self.positions if isinstance(trade, Long))
+
+    @property
+    def exit_book(self):
+        return self.get_exit_book()
+
+    def get_positions(self, symbol=None):
+        positions = self.symbol_positions.get(symbol)
+        if positions is None:
+            positions = self.symbol_positions[symbol] = Positions()
+        return positions
 
-    def open_long(self, price, total, open_dt, fee, leverage=1, stop_loss=None, take_profit=None):
+    def get_exit_book(self, symbol=None):
+        exit_book = self.exit_books.get(symbol)
+        if exit_book is None:
+            exit_book = self.exit_books[symbol] = ExitBook(self.get_positions(symbol))
+        return exit_book
+
+    def add_position(self, trade):
+        self.positions.append(trade)
+        self.get_positions(trade.symbol).append(trade)
+        trade.exit_book = self.get_exit_book(trade.symbol)
+        trade.exit_book.invalidate()
+
+    def remove_position(self, trade):
+        self.positions.remove(trade)
+        self.symbol_positions[trade.symbol].remove(trade)
+        trade.exit_book.invalidate()
+        trade.exit_book = None
+
+    def clear_positions(self):
+        for trade in self.positions:
+            trade.exit_book = None
+        self.positions.clear()
+        for positions in self.symbol_positions.values():
+            positions.clear()
+        for exit_book in self.exit_books.values():
+            exit_book.invalidate()
+
+    def open_long(self, price, total, open_dt, fee, leverage=1, stop_loss=None, take_profit=None, symbol=None):
         # calculate total of symbol b with leverage and total
         leveraged_total = total * leverage
         # lowering leveraged amount of symbol b with fee
@@ -30,24 +103,25 @@ class Broker:
         leveraged_quantity_with_fee = calc_quantity(price, leveraged_total_with_fee)
         # create long instance, save leveraged total of symbol b
         # and the quantity of symbol a that has been exchanged
-        long = Long(leveraged_quantity_with_fee, leveraged_total, open_dt, leverage, stop_loss, take_profit)
-        self.positions.append(long)
+        long = Long(leveraged_quantity_with_fee, leveraged_total, open_dt, leverage, stop_loss, take_profit,
+                    symbol=symbol)
+        self.add_position(long)
         self.equity -= total
         return long
 
-    def close_long(self, price, long, close_dt, fee):
+    def close_long(self, price, long, close_dt, fee, close_reason=CLOSE_MANUAL):
         assert isinstance(long, Long)
         # lowering leveraged amount of symbol a with fee
         leveraged_quantity_with_fee = lower_value_with_fee(long.leveraged_quantity, fee)
         # calculate the equivalent amount of symbol b
         leveraged_total_with_fee = calc_total(price, leveraged_quantity_with_fee)
         # close long, save leveraged total of symbol b that has been exchanged back
-        long.close(leveraged_total_with_fee, close_dt)
-        self.positions.remove(long)
+        long.close(leveraged_total_with_fee, close_dt, close_reason)
+        self.remove_position(long)
         self.history.append(long)
         self.equity += long.leveraged_total_bought / long.leverage + long.calc_profit()
 
-    def open_short(self, price, total, open_dt, fee, leverage=1, stop_loss=None, take_profit=None):
+    def open_short(self, price, total, open_dt, fee, leverage=1, stop_loss=None, take_profit=None, symbol=None):
         # calculate total of symbol a with leverage and total
         leveraged_quantity = calc_quantity(price, total * leverage)
         # lowering leveraged amount of symbol a with fee
@@ -56,18 +130,19 @@ class Broker:
         leveraged_total_with_fee = calc_total(price, leveraged_quantity_with_fee)
         # create short instance, save leveraged quantity of symbol a
         # and the total of symbol a that has been exchanged
-        short = Short(leveraged_quantity, leveraged_total_with_fee, open_dt, leverage, stop_loss, take_profit)
-        self.positions.append(short)
+        short = Short(leveraged_quantity, leveraged_total_with_fee, open_dt, leverage, stop_loss, take_profit,
+                      symbol=symbol)
+        self.add_position(short)
         # borrowed money is not available as regular equity, therefore don't change equity
         return short
 
-    def close_short(self, price, short, close_dt, fee):
+    def close_short(self, price, short, close_dt, fee, close_reason=CLOSE_MANUAL, margin_fee=None):
         assert isinstance(short, Short)
         # calculate the quantity of symbol a that has been borrowed without leverage
         borrowed_quantity = short.leveraged_quantity / short.leverage
-        # calculate the margin fee of symbol a based on opening and rollover
-        hours = (close_dt - short.open_dt).total_seconds() / 3600
-        margin_fee = calc_margin_fee(hours, self.symbol_a_margin_opening_fee, self.symbol_a_margin_rollover_fee)
+        # calculate the margin fee of symbol a based on opening and rollover, unless given by get_margin_fees
+        if margin_fee is None:
+            margin_fee = self.calc_margin_fee_for_duration_ns(to_ns(close_dt) - to_ns(short.open_dt))
         # increasing borrowed quantity with the margin fee
         borrowed_quantity_with_fee = increase_value_with_fee(borrowed_quantity, margin_fee)
         # calculate the total of symbol b for the amount of symbol a that needs to be settled
@@ -77,16 +152,16 @@ class Broker:
         quantity_settle = short.leveraged_quantity + borrowed_quantity_with_fee - borrowed_quantity
         total_settle = calc_total_for_quantity(price, quantity_settle, fee)
         # close long, save the amount of symbol b that was needed to settle the position
-        short.close(total_settle, close_dt)
-        self.positions.remove(short)
+        short.close(total_settle, close_dt, close_reason)
+        self.remove_position(short)
         self.history.append(short)
         self.equity += short.calc_profit()
 
-    def close_trade(self, price, trade, close_dt, fee):
+    def close_trade(self, price, trade, close_dt, fee, close_reason=CLOSE_MANUAL, margin_fee=None):
         if isinstance(trade, Long):
-            self.close_long(price, trade, close_dt, fee)
+            self.close_long(price, trade, close_dt, fee, close_reason)
         elif isinstance(trade, Short):
-            self.close_short(price, trade, close_dt, fee)
+            self.close_short(price, trade, close_dt, fee, close_reason, margin_fee)
         else:
             raise ValueError('trade is neither long or short')
 
@@ -94,9 +169,9 @@ class Broker:
         for trade in self.positions:
             if isinstance(trade, Long):
                 self.equity += trade.leveraged_total_bought / trade.leverage
-        self.positions.clear()
+        self.clear_positions()
 
     def reset(self):
         self.equity = self.initial_equity
-        self.positions.clear()
+        self.clear_positions()
         self.history.clear()
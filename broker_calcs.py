@@ -26,6 +26,16 @@ def calc_margin_fee(hours, opening_fee, rollover_fee):
     return opening_fee + rollover_fee[0] * rollover_fee_count
 
 
+def hours_to_ns(hours):
+    return round(hours * 3600 * 10 ** 9)
+
+
+# same as calc_margin_fee on int64 nanoseconds, the rollover count is an integer division, which is exact and
+# works on numpy arrays as well, e.g. on the durations of all shorts closed on a bar
+def calc_margin_fee_ns(duration_ns, opening_fee, rollover_fee, rollover_period_ns):
+    return opening_fee + rollover_fee * (duration_ns // rollover_period_ns)
+
+
 # calculate the total, that if we were to sell it for a price with fee, equals a quantity
 def calc_total_for_quantity(price, quantity, fee):
     return quantity / ((1 / price) * (1 - fee))
@@ -0,0 +1,234 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .backtest_stats import BacktestStats
+from .bar import get_index_ns
+from .intrabar import IntrabarResolver
+from .ledger import LEDGER_DTYPE, TradeLedger
+
+# part of every key, bump it when a change of the engine changes the results of a backtest
+CACHE_VERSION = 1
+
+# attributes of Backtest holding data or the state of a run, they are not part of the strategy
+ENGINE_ATTRIBUTES = frozenset(('df', 'data_source', 'broker', 'index', 'row', 'previous_row', 'stats', 'bars',
+                               'bar_index', 'start_dt', 'end_dt', 'columnar', 'lookback',
+                               'resample_equity_timeframe', 'run_start', 'state'))
+
+# stats metrics stored with the trades, the others are derived from the trades and the history again
+STATS_METRICS = ('win_rate', 'min_equity', 'max_equity', 'return_perc', 'av_profit_per_trade')
+STATS_DURATIONS = ('period', 'av_trade_duration', 'min_trade_duration', 'max_trade_duration')
+
+
+def update_hash(h, value):
+    # feeds a value into a hash in a way that doesn't depend on the process (unlike hash() or repr() of objects)
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        h.update(f'{type(value).__name__}:{value!r};'.encode())
+    elif isinstance(value, (tuple, list)):
+        h.update(f'{type(value).__name__}[{len(value)}]'.encode())
+        for item in value:
+            update_hash(h, item)
+    elif isinstance(value, dict):
+        h.update(f'dict[{len(value)}]'.encode())
+        for key in sorted(value, key=repr):
+            update_hash(h, key)
+            update_hash(h, value[key])
+    elif isinstance(value, np.ndarray):
+        h.update(f'ndarray{value.shape}{value.dtype.str}'.encode())
+        if value.dtype.kind == 'O':
+            h.update(pickle.dumps(value.tolist()))
+        else:
+            h.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, (pd.Series, pd.Index)):
+        h.update(type(value).__name__.encode())
+        update_hash(h, value.name)
+        update_hash(h, get_index_ns(value) if isinstance(value, pd.DatetimeIndex) else value.to_numpy())
+        if isinstance(value, pd.Series):
+            update_hash(h, value.index)
+    elif isinstance(value, pd.DataFrame):
+        update_hash(h, {column: value[column] for column in value.columns})
+    elif isinstance(value, np.generic):
+        update_hash(h, value.item())
+    elif isinstance(value, IntrabarResolver):
+        # by its data, not by its counters
+        if isinstance(value.source, pd.DataFrame):
+            update_hash(h, value.source)
+        else:
+            update_hash_files(h, value.source)
+    elif callable(value) and hasattr(value, '__qualname__'):
+        # functions, classes and methods by name, e.g. the on_stop_loss callback
+        h.update(f'callable:{getattr(value, "__module__", None)}.{value.__qualname__};'.encode())
+    else:
+        h.update(f'{type(value).__module__}.{type(value).__qualname__}:'.encode())
+        h.update(pickle.dumps(value))
+
+
+def update_hash_files(h, path):
+    # a file or the files of a directory by their names, sizes and modification times, reading their contents
+    # every time a key is made would take longer than many of the runs
+    paths = [path] if os.path.isfile(path) else sorted(os.path.join(path, name) for name in os.listdir(path))
+    for file_path in paths:
+        stat = os.stat(file_path)
+        update_hash(h, (os.path.basename(file_path), stat.st_size, stat.st_mtime_ns))
+
+
+def get_strategy_params(backtest):
+    # public attributes of the backtest that don't belong to the engine, i.e. the parameters the optimizer sets,
+    # strategies should keep the state of a run in underscore attributes, otherwise a rerun gets another key
+    return {name: value for name, value in vars(backtest).items()
+            if not name.startswith('_') and name not in ENGINE_ATTRIBUTES}
+
+
+def get_class_source(cls):
+    try:
+        return inspect.getsource(cls)
+    except (OSError, TypeError):
+        # e.g. defined in an interactive session, fall back to the name of the class
+        return None
+
+
+def make_key(backtest, start=-1, end=-1):
+    # content address of a run: the history up to the end of the run (next() may look back before the start),
+    # the strategy (its class, code and parameters) and the broker configuration
+    assert backtest.df is not None, 'only backtests on a dataframe can be cached'
+    df = backtest.df
+    start = 0 if start == -1 else start
+    end = len(df) if end == -1 else end
+    h = hashlib.sha256()
+    update_hash(h, CACHE_VERSION)
+    update_hash(h, (start, end))
+    update_hash(h, list(df.columns))
+    update_hash(h, df.index[:end])
+    for column in df.columns:
+        update_hash(h, df[column].to_numpy()[:end])
+    cls = type(backtest)
+    update_hash(h, f'{cls.__module__}.{cls.__qualname__}')
+    update_hash(h, get_class_source(cls))
+    update_hash(h, get_strategy_params(backtest))
+    broker = backtest.broker
+    update_hash(h, f'{type(broker).__module__}.{type(broker).__qualname__}')
+    update_hash(h, (broker.initial_equity, broker.maker_fee, broker.taker_fee, broker.symbol_a_margin_opening_fee,
+                    tuple(broker.symbol_a_margin_rollover_fee)))
+    return h.hexdigest()
+
+
+def to_ns_or_none(value):
+    return None if value is None else int(value.value)
+
+
+class ResultCache:
+    # results of backtests on local disk, one compressed .npz per run holding the columns of the trade ledger
+    # and the stats metrics, the least recently used runs are evicted once the files take more than max_bytes,
+    # writes are atomic, so several processes (e.g. optimizer workers) can share a directory
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.get_path(key))
+
+    def save(self, key, backtest):
+        stats = backtest.stats
+        history = backtest.broker.history
+        meta = {
+            'final_equity': backtest.broker.equity,
+            'tz': None if history.tz is None else str(history.tz),
+            'symbols': history.symbols
+        }
+        for name in STATS_METRICS:
+            value = getattr(stats, name)
+            meta[name] = None if value is None else float(value)
+        for name in STATS_DURATIONS:
+            meta[name] = to_ns_or_none(getattr(stats, name))
+        try:
+            meta = json.dumps(meta)
+        except TypeError:
+            # symbols that can't be stored as json, the run is not cached
+            return False
+        records = history.records
+        path = self.get_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, meta=np.array(meta), **{name: records[name] for name in records.dtype.names})
+        os.replace(tmp_path, path)
+        self.evict()
+        return True
+
+    def load(self, key, backtest, start=-1, end=-1):
+        # puts the trades and the stats of a cached run into the backtest as if it had been run,
+        # the state the strategy keeps in its own attributes is not restored
+        path = self.get_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                meta = json.loads(npz['meta'].item())
+                records = np.empty(len(npz['side']), LEDGER_DTYPE)
+                for name in records.dtype.names:
+                    records[name] = npz[name]
+            # the run was used now, which keeps it from being evicted
+            os.utime(path)
+        except FileNotFoundError:
+            # not cached or evicted in the meantime
+            return False
+        df = backtest.df
+        start = 0 if start == -1 else start
+        end = len(df) if end == -1 else end
+        broker = backtest.broker
+        broker.reset()
+        tz = None if meta['tz'] is None else pd.Timestamp(0, tz=meta['tz']).tz
+        broker.history = TradeLedger.from_records(records, tz, meta['symbols'])
+        broker.equity = meta['final_equity']
+        backtest.index = end
+        backtest.start_dt = df.index[start]
+        backtest.end_dt = df.index[end - 1]
+        stats = BacktestStats(backtest, start, end, backtest.resample_equity_timeframe)
+        # prefill the cached properties of the stats
+        for name in STATS_METRICS:
+            stats.__dict__[name] = meta[name]
+        for name in STATS_DURATIONS:
+            stats.__dict__[name] = None if meta[name] is None else pd.Timedelta(meta[name], 'ns')
+        backtest.stats = stats
+        return True
+
+    def run(self, backtest, start=-1, end=-1):
+        # loads the results of an identical run from the cache or runs the backtest and stores its results,
+        # returns whether the results came from the cache
+        key = make_key(backtest, start, end)
+        if self.load(key, backtest, start, end):
+            return True
+        backtest.run(start, end)
+        self.save(key, backtest)
+        return False
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.directory, name))
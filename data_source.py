@@ -0,0 +1,111 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .bar import Bars, get_index_ns
+
+
+class DataSource:
+    # provides the history as consecutive dataframes (chunks), so a backtest never needs all of it in memory
+    def iter_chunks(self, start=0):
+        # chunks of the history from the bar at position start on
+        raise NotImplementedError
+
+    def iter_bars(self, lookback=0, start=0):
+        # bars of every chunk, prefixed by up to lookback bars of the chunks before it,
+        # together with the position of the first of these bars in the whole history,
+        # the bars before start are not read except for the lookback bars right before it
+        position = max(start - lookback, 0)
+        tail = None
+        for chunk in self.iter_chunks(position):
+            if not len(chunk):
+                continue
+            bars = Bars(chunk)
+            first_position = position
+            if tail is not None and len(tail):
+                bars = tail.concat(bars)
+                first_position -= len(tail)
+            yield first_position, bars
+            position += len(chunk)
+            tail = bars.tail(lookback)
+
+
+class DataFrameSource(DataSource):
+    def __init__(self, df, chunk_size=100_000):
+        self.df = df
+        self.chunk_size = chunk_size
+
+    def iter_chunks(self, start=0):
+        for i in range(start, len(self.df), self.chunk_size):
+            yield self.df.iloc[i:i + self.chunk_size]
+
+
+class CsvSource(DataSource):
+    def __init__(self, path, chunk_size=100_000, **read_csv_kwargs):
+        self.path = path
+        self.chunk_size = chunk_size
+        read_csv_kwargs.setdefault('index_col', 0)
+        read_csv_kwargs.setdefault('parse_dates', True)
+        self.read_csv_kwargs = read_csv_kwargs
+
+    def iter_chunks(self, start=0):
+        # the lines before start are skipped without being parsed, the header stays
+        read_csv_kwargs = dict(self.read_csv_kwargs, skiprows=range(1, start + 1)) if start else self.read_csv_kwargs
+        with pd.read_csv(self.path, chunksize=self.chunk_size, **read_csv_kwargs) as reader:
+            yield from reader
+
+
+class ParquetSource(DataSource):
+    # reads one row group at a time, needs pyarrow
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.columns = columns
+
+    def iter_chunks(self, start=0):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(self.path)
+        for i in range(parquet_file.num_row_groups):
+            # the row groups before start are skipped by the row counts in the metadata
+            num_rows = parquet_file.metadata.row_group(i).num_rows
+            if start >= num_rows:
+                start -= num_rows
+                continue
+            chunk = parquet_file.read_row_group(i, columns=self.columns, use_pandas_metadata=True).to_pandas()
+            yield chunk.iloc[start:]
+            start = 0
+
+
+class NpySource(DataSource):
+    # memory mapped .npy files per column as written by save_npy, only the current chunk is read into memory
+    def __init__(self, directory, chunk_size=100_000):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    def load(self, name):
+        return np.load(os.path.join(self.directory, f'{name}.npy'), mmap_mode='r')
+
+    def iter_chunks(self, start=0):
+        index = self.load('index')
+        columns = {column: self.load(column) for column in self.meta['columns']}
+        for i in range(start, len(index), self.chunk_size):
+            chunk_index = pd.DatetimeIndex(np.array(index[i:i + self.chunk_size]).view('datetime64[ns]'),
+                                           name=self.meta['index_name'])
+            if self.meta['tz'] is not None:
+                chunk_index = chunk_index.tz_localize('UTC').tz_convert(self.meta['tz'])
+            yield pd.DataFrame({column: np.array(values[i:i + self.chunk_size]) for column, values in columns.items()},
+                               index=chunk_index)
+
+
+def save_npy(df, directory):
+    # write a dataframe with a datetime index in the layout read by NpySource
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'index.npy'), get_index_ns(df.index))
+    for column in df.columns:
+        np.save(os.path.join(directory, f'{column}.npy'), df[column].to_numpy())
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'columns': list(df.columns), 'index_name': df.index.name,
+                   'tz': None if df.index.tz is None else str(df.index.tz)}, f)
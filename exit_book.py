@@ -0,0 +1,97 @@
+import numpy as np
+
+from .trade import Long, Short
+
+
+def find_first_cross(lows, highs, low_level, high_level, start, stop, min_window=64):
+    # first bar in [start, stop) whose low reaches low_level or whose high reaches high_level, stop if there is none,
+    # searched in windows doubling in size, so a cross close to start doesn't pay for scanning the whole range
+    window = min_window
+    while start < stop:
+        window_stop = min(start + window, stop)
+        hit = (lows[start:window_stop] <= low_level) | (highs[start:window_stop] >= high_level)
+        i = hit.argmax()
+        if hit[i]:
+            return start + i
+        start = window_stop
+        window *= 2
+    return stop
+
+
+def is_level(level):
+    # a stop loss or take profit of None or nan (e.g. from an indicator that isn't defined yet) is no level,
+    # as no price compares true against nan
+    return level is not None and level == level
+
+
+class ExitBook:
+    # keeps the stop loss and take profit levels of the open positions in arrays, split into the levels that trigger
+    # when the low reaches them (long stop loss, short take profit) and the ones that trigger when the high reaches
+    # them (long take profit, short stop loss), so a single comparison against a bar finds the triggered trades
+    def __init__(self, positions, min_search_window=64):
+        self.positions = positions
+        self.min_search_window = min_search_window
+        self.dirty = True
+        self.trades = []
+        self.low_levels = np.empty(0)
+        self.high_levels = np.empty(0)
+        self.max_low_level = -np.inf
+        self.min_high_level = np.inf
+        # index of the next bar that needs to be looked at, valid as long as the levels don't change
+        self.next_index = 0
+        self.search_window = min_search_window
+
+    def invalidate(self):
+        self.dirty = True
+
+    def rebuild(self):
+        self.trades = list(self.positions)
+        self.low_levels = np.full(len(self.trades), -np.inf)
+        self.high_levels = np.full(len(self.trades), np.inf)
+        for i, trade in enumerate(self.trades):
+            if isinstance(trade, Long):
+                low_level, high_level = trade.stop_loss, trade.take_profit
+            elif isinstance(trade, Short):
+                low_level, high_level = trade.take_profit, trade.stop_loss
+            else:
+                raise ValueError('trade is neither long or short')
+            if is_level(low_level):
+                self.low_levels[i] = low_level
+            if is_level(high_level):
+                self.high_levels[i] = high_level
+        self.max_low_level = self.low_levels.max(initial=-np.inf)
+        self.min_high_level = self.high_levels.min(initial=np.inf)
+        self.next_index = 0
+        self.search_window = self.min_search_window
+        self.dirty = False
+
+    def crossed(self, low, high):
+        # trades with a level inside the range of the bar, in the order of the positions
+        if self.dirty:
+            self.rebuild()
+        if low > self.max_low_level and high < self.min_high_level:
+            return []
+        return [self.trades[i] for i in np.flatnonzero((self.low_levels >= low) | (self.high_levels <= high))]
+
+    def search(self, lows, highs, start, stop):
+        # first bar in [start, stop) crossing any level, stop if there is none
+        return find_first_cross(lows, highs, self.max_low_level, self.min_high_level, start, stop, stop - start)
+
+    def triggered(self, index, lows, highs):
+        # same as crossed for the bar at index, but jumps over the bars that can't trigger anything,
+        # the searched window doubles with every miss to keep the search cost proportional to the jump
+        if self.dirty:
+            self.rebuild()
+        elif index < self.next_index:
+            return []
+        if not self.trades:
+            self.next_index = len(lows)
+            return []
+        stop = min(index + self.search_window, len(lows))
+        self.next_index = self.search(lows, highs, index, stop)
+        if self.next_index > index:
+            if self.next_index == stop:
+                self.search_window *= 2
+            return []
+        self.next_index = index + 1
+        return self.crossed(lows[index], highs[index])
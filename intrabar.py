@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from .bar import get_index_ns
+from .data_source import NpySource
+
+LOW_FIRST = -1
+HIGH_FIRST = 1
+UNRESOLVED = 0
+
+
+class IntrabarResolver:
+    # lower timeframe companion of the history (e.g. 1 minute bars for hourly bars), consulted by the backtest only
+    # for bars where both the stop loss and the take profit of a position are inside the range of the bar, to find
+    # out which of them was reached first instead of guessing it,
+    # source is a dataframe, a directory written by save_npy (memory mapped) or a parquet file (needs pyarrow),
+    # only the index, Low and High are used and they are loaded on the first query
+    def __init__(self, source):
+        self.source = source
+        self.times = None
+        self.lows = None
+        self.highs = None
+        # number of queries answered from the lower timeframe and of those left to the heuristics of the backtest
+        self.resolved = 0
+        self.unresolved = 0
+
+    def load(self):
+        source = self.source
+        if isinstance(source, pd.DataFrame):
+            df = source
+        elif os.path.isdir(source):
+            npy_source = NpySource(source)
+            self.times = npy_source.load('index')
+            self.lows = npy_source.load('Low')
+            self.highs = npy_source.load('High')
+            return
+        else:
+            import pyarrow.parquet as pq
+            df = pq.read_table(source, columns=['Low', 'High'], use_pandas_metadata=True).to_pandas()
+        self.times = get_index_ns(df.index)
+        self.lows = df['Low'].to_numpy()
+        self.highs = df['High'].to_numpy()
+
+    def first_cross(self, low_level, high_level, start_ns, end_ns):
+        # which of the levels the lower timeframe bars in [start_ns, end_ns) reach first,
+        # UNRESOLVED if there are no such bars or the first one reaching a level reaches both
+        if self.times is None:
+            self.load()
+        start = np.searchsorted(self.times, start_ns)
+        stop = np.searchsorted(self.times, end_ns)
+        low_hits = np.flatnonzero(self.lows[start:stop] <= low_level)
+        high_hits = np.flatnonzero(self.highs[start:stop] >= high_level)
+        first_low = low_hits[0] if len(low_hits) else stop - start
+        first_high = high_hits[0] if len(high_hits) else stop - start
+        if first_low < first_high:
+            self.resolved += 1
+            return LOW_FIRST
+        if first_high < first_low:
+            self.resolved += 1
+            return HIGH_FIRST
+        self.unresolved += 1
+        return UNRESOLVED
@@ -0,0 +1,283 @@
+import numpy as np
+import pandas as pd
+
+from .trade import Long, Short
+
+LONG = 1
+SHORT = -1
+
+LEDGER_DTYPE = np.dtype([
+    ('side', 'i1'),
+    ('leveraged_quantity', 'f8'),
+    ('leverage', 'f8'),
+    ('leveraged_total_sold', 'f8'),
+    ('leveraged_total_bought', 'f8'),
+    # timestamps as int64 nanoseconds since epoch (utc)
+    ('open_dt', 'i8'),
+    ('close_dt', 'i8'),
+    # nan if the trade had no stop loss or take profit
+    ('stop_loss', 'f8'),
+    ('take_profit', 'f8'),
+    ('close_reason', 'i1'),
+    # position of the symbol in the symbols of the ledger, -1 if the trade had no symbol
+    ('symbol', 'i4')
+])
+
+
+def to_ns(dt):
+    return pd.Timestamp(dt).value
+
+
+def level_or_nan(level):
+    return np.nan if level is None else level
+
+
+class Positions:
+    # open trades in the order they have been opened, backed by a dict so removing a trade doesn't scan the list
+    def __init__(self, trades=None):
+        self.trades = dict.fromkeys(trades or ())
+
+    def append(self, trade):
+        self.trades[trade] = None
+
+    def remove(self, trade):
+        try:
+            del self.trades[trade]
+        except KeyError:
+            raise ValueError('trade is not an open position') from None
+
+    def clear(self):
+        self.trades.clear()
+
+    def copy(self):
+        return list(self.trades)
+
+    def __len__(self):
+        return len(self.trades)
+
+    def __bool__(self):
+        return bool(self.trades)
+
+    def __contains__(self, trade):
+        return trade in self.trades
+
+    def __iter__(self):
+        return iter(self.trades)
+
+    def __getitem__(self, i):
+        return list(self.trades)[i]
+
+
+class TradeLedger:
+    # closed trades stored column wise in a structured numpy array, the capacity doubles when it runs out
+    def __init__(self, trades=None, capacity=1024):
+        self.data = np.zeros(capacity, LEDGER_DTYPE)
+        self.size = 0
+        self.tz = None
+        self.symbols = []
+        self.symbol_codes = {}
+        if trades is not None:
+            self.extend(trades)
+
+    @classmethod
+    def from_records(cls, records, tz=None, symbols=()):
+        # ledger on top of records with the layout of LEDGER_DTYPE, e.g. loaded from disk
+        ledger = cls(capacity=max(len(records), 1))
+        ledger.data[:len(records)] = records
+        ledger.size = len(records)
+        ledger.tz = tz
+        ledger.symbols = list(symbols)
+        ledger.symbol_codes = {symbol: code for code, symbol in enumerate(ledger.symbols)}
+        return ledger
+
+    def append(self, trade):
+        if self.size == len(self.data):
+            self.data = np.resize(self.data, max(2 * len(self.data), 1))
+        if isinstance(trade, Long):
+            side = LONG
+        elif isinstance(trade, Short):
+            side = SHORT
+        else:
+            raise ValueError('trade is neither long or short')
+        if self.size == 0:
+            self.tz = getattr(trade.open_dt, 'tz', None)
+        self.data[self.size] = (side, trade.leveraged_quantity, trade.leverage, trade.leveraged_total_sold,
+                                trade.leveraged_total_bought, to_ns(trade.open_dt), to_ns(trade.close_dt),
+                                level_or_nan(trade.stop_loss), level_or_nan(trade.take_profit), trade.close_reason,
+                                self.get_symbol_code(trade.symbol))
+        self.size += 1
+
+    def get_symbol_code(self, symbol):
+        if symbol is None:
+            return -1
+        code = self.symbol_codes.get(symbol)
+        if code is None:
+            code = self.symbol_codes[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return code
+
+    def extend(self, trades):
+        for trade in trades:
+            self.append(trade)
+
+    def clear(self):
+        self.size = 0
+
+    def copy(self):
+        ledger = TradeLedger(capacity=max(self.size, 1))
+        ledger.data[:self.size] = self.data[:self.size]
+        ledger.size = self.size
+        ledger.tz = self.tz
+        ledger.symbols = self.symbols.copy()
+        ledger.symbol_codes = self.symbol_codes.copy()
+        return ledger
+
+    @property
+    def records(self):
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [TradeView(self, j) for j in range(*i.indices(self.size))]
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('trade ledger index out of range')
+        return TradeView(self, i)
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield TradeView(self, i)
+
+    def get_profits(self):
+        records = self.records
+        return records['leveraged_total_sold'] - records['leveraged_total_bought']
+
+    def get_durations_ns(self):
+        records = self.records
+        return records['close_dt'] - records['open_dt']
+
+    def get_symbols(self):
+        # symbol of every trade, None for trades without one
+        symbols = np.empty(len(self.symbols) + 1, dtype=object)
+        for i, symbol in enumerate(self.symbols):
+            symbols[i] = symbol
+        return symbols[self.records['symbol']]
+
+    def to_datetime(self, ns):
+        index = pd.DatetimeIndex(ns.view('datetime64[ns]'))
+        return index if self.tz is None else index.tz_localize('UTC').tz_convert(self.tz)
+
+    def to_df(self):
+        records = self.records
+        df = pd.DataFrame({
+            'Symbol': self.get_symbols(),
+            'Side': np.where(records['side'] == LONG, 'long', 'short'),
+            'Leveraged Quantity': records['leveraged_quantity'],
+            'Leverage': records['leverage'],
+            'Leveraged Total Sold': records['leveraged_total_sold'],
+            'Leveraged Total Bought': records['leveraged_total_bought'],
+            'Open Datetime': self.to_datetime(records['open_dt']),
+            'Close Datetime': self.to_datetime(records['close_dt']),
+            'Stop Loss': records['stop_loss'],
+            'Take Profit': records['take_profit'],
+            'Close Reason': records['close_reason'],
+            'Profit': self.get_profits()
+        })
+        df['Duration'] = df['Close Datetime'] - df['Open Datetime']
+        return df
+
+
+class TradeView:
+    # read only view on a row of the ledger, mirrors the attributes and methods of a closed trade
+    __slots__ = ('ledger', 'i')
+
+    def __init__(self, ledger, i):
+        self.ledger = ledger
+        self.i = i
+
+    def get(self, field):
+        return self.ledger.data[field][self.i].item()
+
+    def get_dt(self, field):
+        return pd.Timestamp(self.get(field), tz=self.ledger.tz)
+
+    def get_level(self, field):
+        level = self.get(field)
+        return None if level != level else level
+
+    @property
+    def is_long(self):
+        return self.get('side') == LONG
+
+    @property
+    def is_short(self):
+        return self.get('side') == SHORT
+
+    @property
+    def leveraged_quantity(self):
+        return self.get('leveraged_quantity')
+
+    @property
+    def leverage(self):
+        return self.get('leverage')
+
+    @property
+    def leveraged_total_sold(self):
+        return self.get('leveraged_total_sold')
+
+    @property
+    def leveraged_total_bought(self):
+        return self.get('leveraged_total_bought')
+
+    @property
+    def open_dt(self):
+        return self.get_dt('open_dt')
+
+    @property
+    def close_dt(self):
+        return self.get_dt('close_dt')
+
+    @property
+    def stop_loss(self):
+        return self.get_level('stop_loss')
+
+    @property
+    def take_profit(self):
+        return self.get_level('take_profit')
+
+    @property
+    def close_reason(self):
+        return self.get('close_reason')
+
+    @property
+    def symbol(self):
+        code = self.get('symbol')
+        return None if code == -1 else self.ledger.symbols[code]
+
+    def calc_profit(self):
+        return self.leveraged_total_sold - self.leveraged_total_bought
+
+    def get_duration(self):
+        return pd.Timedelta(self.get('close_dt') - self.get('open_dt'))
+
+    def to_trade(self):
+        # materialize the row as a closed long or short again
+        if self.is_long:
+            trade = Long(self.leveraged_quantity, self.leveraged_total_bought, self.open_dt, self.leverage,
+                         self.stop_loss, self.take_profit, self.leveraged_total_sold, self.close_dt, self.symbol)
+        else:
+            trade = Short(self.leveraged_quantity, self.leveraged_total_sold, self.open_dt, self.leverage,
+                          self.stop_loss, self.take_profit, self.leveraged_total_bought, self.close_dt, self.symbol)
+        trade.close_reason = self.close_reason
+        return trade
+
+    def __repr__(self):
+        return f'TradeView({"long" if self.is_long else "short"}, open_dt={self.open_dt}, close_dt={self.close_dt}, ' \
+               f'profit={self.calc_profit()})'
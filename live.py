@@ -0,0 +1,184 @@
+import asyncio
+import json
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from .bar import Bars
+from .backtest_stats import BacktestStats
+
+
+class LiveRunner:
+    # runs the strategy of a backtest (next() and the broker accounting) on bars arriving from an async iterator,
+    # e.g. a live feed for paper trading, every bar goes through Backtest.process_bar like in a backtest run,
+    # the feed yields (datetime, {column: value}) tuples with at least Open, High, Low and Close,
+    # bars are read from the feed into a queue of queue_size bars, once the strategy falls behind and the queue is
+    # full the feed is not read any further until it catches up (backpressure),
+    # the strategy sees the last window bars (at least lookback + 1) in self.bars
+    def __init__(self, backtest, feed, queue_size=100, window=1000):
+        assert backtest.df is None and backtest.data_source is None, 'a live backtest has no history, pass None'
+        assert backtest.columnar, 'live runs are only supported with columnar bars'
+        self.backtest = backtest
+        self.feed = feed
+        self.queue_size = queue_size
+        self.window = max(window, backtest.lookback + 1)
+        self.subscribers = []
+        self.subscriber_queues = []
+        self.columns = None
+        self.times = []
+        self.size = 0
+        self.trade_events = []
+        # seconds from taking a bar from the queue until its events have been handed to the subscribers, recent bars
+        self.latencies = deque(maxlen=10_000)
+
+    def subscribe(self, callback, queue_size=1000):
+        # callback is an async function called with every event in order, events are dicts with a type of 'open'
+        # or 'close' (with the trade) or 'equity' (after every bar, the realized equity and the cash, which is
+        # lower by the capital tied up in the open longs),
+        # a subscriber has a queue of its own, a slow one holds up the runner only once its queue is full
+        self.subscribers.append((callback, queue_size))
+
+    def append(self, dt, values):
+        if self.columns is None:
+            self.columns = {column: np.empty(2 * self.window) for column in values}
+        elif self.size == len(self.columns['Close']):
+            # keep the last bars in new buffers, the bars handed out before (e.g. the previous row) stay valid
+            keep = self.window - 1
+            self.columns = {column: np.concatenate((buffer[self.size - keep:], np.empty(2 * self.window - keep)))
+                            for column, buffer in self.columns.items()}
+            self.times = self.times[-keep:]
+            self.size = keep
+            # the exit books jump ahead by positions in the bars, which have moved
+            for exit_book in self.backtest.broker.exit_books.values():
+                exit_book.invalidate()
+        for column, buffer in self.columns.items():
+            buffer[self.size] = values[column]
+        self.times.append(pd.Timestamp(dt))
+        self.size += 1
+        self.backtest.bars = Bars.from_columns({column: buffer[:self.size] for column, buffer in self.columns.items()},
+                                               self.times)
+        self.backtest.bar_index = self.size - 1
+
+    async def publish(self, event):
+        for queue in self.subscriber_queues:
+            await queue.put(event)
+
+    async def produce(self, queue):
+        async for bar in self.feed:
+            await queue.put(bar)
+        await queue.put(None)
+
+    async def consume(self, queue):
+        backtest = self.backtest
+        while True:
+            bar = await queue.get()
+            if bar is None:
+                break
+            start = asyncio.get_running_loop().time()
+            self.append(*bar)
+            row = backtest.bars.bar(backtest.bar_index)
+            if backtest.start_dt is None:
+                backtest.start_dt = row.name
+            backtest.process_bar(row)
+            backtest.end_dt = row.name
+            for event_type, trade in self.trade_events:
+                await self.publish({'type': event_type, 'dt': row.name, 'trade': trade})
+            self.trade_events.clear()
+            await self.publish({'type': 'equity', 'dt': row.name, 'equity': backtest.broker.realized_equity,
+                                'cash': backtest.broker.equity})
+            self.latencies.append(asyncio.get_running_loop().time() - start)
+        for subscriber_queue in self.subscriber_queues:
+            await subscriber_queue.put(None)
+
+    def recorded(self, event_type, method):
+        def recording_method(trade):
+            method(trade)
+            self.trade_events.append((event_type, trade))
+        return recording_method
+
+    def attach(self, broker):
+        # every position the broker adds or removes is an opened or closed trade, in the order it happened,
+        # the trade is closed before it is removed
+        broker.add_position = self.recorded('open', broker.add_position)
+        broker.remove_position = self.recorded('close', broker.remove_position)
+
+    @staticmethod
+    def detach(broker):
+        for name in ('add_position', 'remove_position'):
+            broker.__dict__.pop(name, None)
+
+    @staticmethod
+    async def deliver(callback, queue):
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            await callback(event)
+
+    async def run(self):
+        # runs until the feed ends, positions still open then stay open, returns the stats of the run,
+        # which like the equity events count the realized equity
+        backtest = self.backtest
+        backtest.index = 0
+        backtest.start_dt = None
+        queue = asyncio.Queue(self.queue_size)
+        self.subscriber_queues = [asyncio.Queue(queue_size) for _, queue_size in self.subscribers]
+        tasks = [asyncio.ensure_future(self.produce(queue)), asyncio.ensure_future(self.consume(queue))]
+        tasks += [asyncio.ensure_future(self.deliver(callback, subscriber_queue))
+                  for (callback, _), subscriber_queue in zip(self.subscribers, self.subscriber_queues)]
+        self.attach(backtest.broker)
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.detach(backtest.broker)
+        for task in done:
+            task.result()
+        if backtest.start_dt is not None:
+            backtest.stats = BacktestStats(backtest, -1, -1, backtest.resample_equity_timeframe)
+        return backtest.stats
+
+
+def parse_bar(line, columns):
+    # a csv line with the datetime in the first column
+    values = line.rstrip('\n').split(',')
+    return pd.Timestamp(values[0]), {column: float(value) for column, value in zip(columns, values[1:])}
+
+
+async def csv_tail_feed(path, follow=True, poll_interval=0.5):
+    # stand-in for an exchange feed: the bars of a csv file (header, datetime in the first column), with follow the
+    # file is watched for bars appended to it like tail -f does, a line is only used once it is complete
+    with open(path) as f:
+        columns = f.readline().rstrip('\n').split(',')[1:]
+        line = ''
+        while True:
+            line += f.readline()
+            if line.endswith('\n'):
+                yield parse_bar(line, columns)
+                line = ''
+            elif follow:
+                await asyncio.sleep(poll_interval)
+            else:
+                if line:
+                    yield parse_bar(line, columns)
+                return
+
+
+async def json_lines_feed(reader, time_key='Datetime'):
+    # bars as json objects, one per line, e.g. {"Datetime": "2021-01-01 00:00", "Open": 1, ...},
+    # reader is an asyncio.StreamReader, not reading from it throttles the sender through the socket
+    async for line in reader:
+        bar = json.loads(line)
+        yield pd.Timestamp(bar.pop(time_key)), bar
+
+
+async def socket_feed(host, port, time_key='Datetime'):
+    # json lines bars from a tcp socket until the other side closes it
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        async for bar in json_lines_feed(reader, time_key):
+            yield bar
+    finally:
+        writer.close()
@@ -0,0 +1,208 @@
+import copy
+import itertools
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .bar import get_index_ns
+
+DEFAULT_METRICS = ('return_perc', 'win_rate', 'min_equity', 'max_equity', 'av_profit_per_trade')
+
+# state of a worker process, set up once by init_worker instead of being pickled with every task
+_worker_backtest = None
+_worker_df = None
+_worker_shms = []
+
+
+class SharedFrame:
+    # numeric columns (and a datetime index) of a dataframe placed in shared memory,
+    # workers rebuild the dataframe on top of the shared buffers without copying the data through pickle
+    def __init__(self, df):
+        self.shms = []
+        self.columns = []
+        self.other_columns = {}
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if values.dtype.kind in 'biuf':
+                self.columns.append((column, self.share(values)))
+            else:
+                self.other_columns[column] = values
+        if isinstance(df.index, pd.DatetimeIndex):
+            self.index = self.share(get_index_ns(df.index))
+            self.index_tz = df.index.tz
+            self.index_name = df.index.name
+        else:
+            self.index = df.index
+            self.index_tz = None
+            self.index_name = None
+
+    def share(self, values):
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, values.dtype, buffer=shm.buf)[:] = values
+        self.shms.append(shm)
+        return shm.name, values.shape, values.dtype.str
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shms'] = []
+        return state
+
+    @staticmethod
+    def attach(spec, shms):
+        name, shape, dtype = spec
+        shm = shared_memory.SharedMemory(name=name)
+        shms.append(shm)
+        return np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+
+    def to_df(self, shms):
+        if isinstance(self.index, tuple):
+            index = pd.DatetimeIndex(self.attach(self.index, shms).view('datetime64[ns]'), name=self.index_name)
+            if self.index_tz is not None:
+                index = index.tz_localize('UTC').tz_convert(self.index_tz)
+        else:
+            index = self.index
+        data = {column: self.attach(spec, shms) for column, spec in self.columns}
+        data.update(self.other_columns)
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def close(self):
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+        self.shms = []
+
+
+def init_worker(backtest, shared_frame):
+    global _worker_backtest, _worker_df
+    _worker_backtest = backtest
+    _worker_df = shared_frame.to_df(_worker_shms)
+
+
+def run_params(backtest, df, params, metrics, start, end, cache=None):
+    backtest = copy.deepcopy(backtest)
+    backtest.df = df
+    for name, value in params.items():
+        setattr(backtest, name, value)
+    if cache is None:
+        backtest.run(start, end)
+    else:
+        # finished combinations of an interrupted sweep come from the cache
+        cache.run(backtest, start, end)
+    result = {}
+    for metric in metrics:
+        result[metric_name(metric)] = metric(backtest.stats) if callable(metric) else getattr(backtest.stats, metric)
+    result['final_equity'] = backtest.broker.equity
+    result['trades'] = len(backtest.broker.history)
+    return result
+
+
+def run_worker_task(task):
+    params, metrics, start, end, cache = task
+    return run_params(_worker_backtest, _worker_df, params, metrics, start, end, cache)
+
+
+def make_grid(param_grid):
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+
+
+def sample_grid(param_grid, n_iter, random_state=None):
+    grid = make_grid(param_grid)
+    if n_iter >= len(grid):
+        return grid
+    return random.Random(random_state).sample(grid, n_iter)
+
+
+def metric_name(metric):
+    return metric if isinstance(metric, str) else getattr(metric, '__name__', 'metric')
+
+
+class Optimizer:
+    def __init__(self, backtest, metric='return_perc', metrics=DEFAULT_METRICS, maximize=True, n_jobs=None,
+                 cache=None):
+        assert backtest.df is not None, 'the optimizer needs the history as a dataframe'
+        # the template is pickled once per worker, it must not carry the data or the results of a previous run
+        self.template = copy.copy(backtest)
+        self.template.df = None
+        self.template.bars = None
+        self.template.row = None
+        self.template.previous_row = None
+        self.template.stats = None
+        self.template.state = None
+        self.template.broker = copy.deepcopy(backtest.broker)
+        self.template.broker.reset()
+        self.df = backtest.df
+        self.metric = metric
+        self.metrics = [metric] + [m for m in metrics if m != metric]
+        self.maximize = maximize
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.cache = cache
+
+    def evaluate(self, candidates, start=-1, end=-1, executor=None):
+        tasks = [(params, self.metrics, start, end, self.cache) for params in candidates]
+        if executor is None:
+            results = [run_params(self.template, self.df, *task) for task in tasks]
+        else:
+            chunksize = max(1, len(tasks) // (self.n_jobs * 4))
+            results = list(executor.map(run_worker_task, tasks, chunksize=chunksize))
+        return pd.DataFrame([{**params, **result} for params, result in zip(candidates, results)])
+
+    def rank(self, table):
+        # runs without a value for the metric (e.g. no trades) end up last
+        return table.sort_values(metric_name(self.metric), ascending=not self.maximize,
+                                 na_position='last', kind='stable').reset_index(drop=True)
+
+    def successive_halving(self, candidates, start, end, eta, min_bars, executor):
+        start = 0 if start == -1 else start
+        end = len(self.df) if end == -1 else end
+        rounds = max(1, math.ceil(math.log(len(candidates), eta))) if len(candidates) > 1 else 1
+        # rounded up, so the last round runs on all bars instead of on almost all bars and again on all of them
+        bars = max(min_bars, math.ceil((end - start) / eta ** (rounds - 1)))
+        tables = []
+        while True:
+            bars = min(bars, end - start)
+            table = self.rank(self.evaluate(candidates, start, start + bars, executor))
+            table['bars'] = bars
+            if len(candidates) == 1 or bars == end - start:
+                tables.append(table)
+                break
+            keep = max(1, len(candidates) // eta)
+            tables.append(table.iloc[keep:])
+            param_names = [name for name in table.columns if name in candidates[0]]
+            candidates = table.iloc[:keep][param_names].to_dict('records')
+            bars *= eta
+        # the candidates that made it furthest come first, each group ranked by the metric
+        return pd.concat(tables[::-1], ignore_index=True)
+
+    def optimize(self, param_grid, method='grid', n_iter=None, random_state=None, start=-1, end=-1, eta=3,
+                 min_bars=1000):
+        if method not in ('grid', 'random', 'halving'):
+            raise ValueError(f'unknown optimization method {method}')
+        # random search samples n_iter candidates (10 by default), halving starts from the whole grid unless n_iter is given
+        if method == 'random':
+            candidates = sample_grid(param_grid, n_iter or 10, random_state)
+        elif method == 'halving' and n_iter is not None:
+            candidates = sample_grid(param_grid, n_iter, random_state)
+        else:
+            candidates = make_grid(param_grid)
+        assert candidates
+        if self.n_jobs == 1:
+            executor = None
+            shared_frame = None
+        else:
+            shared_frame = SharedFrame(self.df)
+            executor = ProcessPoolExecutor(self.n_jobs, initializer=init_worker,
+                                           initargs=(self.template, shared_frame))
+        try:
+            if method == 'halving':
+                return self.successive_halving(candidates, start, end, eta, min_bars, executor)
+            return self.rank(self.evaluate(candidates, start, end, executor))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+                shared_frame.close()
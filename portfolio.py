@@ -0,0 +1,106 @@
+import numpy as np
+
+from .bar import Bars, get_index_ns
+from .backtest import Backtest
+
+
+def merge_timelines(timelines):
+    # k-way merge of the sorted int64 timelines of all symbols, the stable sort merges the already sorted runs,
+    # returns the merged timestamps along with the symbol and the position in its bars of every entry
+    times = np.concatenate(timelines)
+    symbols = np.repeat(np.arange(len(timelines)), [len(timeline) for timeline in timelines])
+    positions = np.concatenate([np.arange(len(timeline)) for timeline in timelines])
+    order = np.argsort(times, kind='stable')
+    return times[order], symbols[order], positions[order]
+
+
+class PortfolioBacktest(Backtest):
+    # backtest over several instruments sharing the equity of one broker, next() is called once per timestamp of the
+    # merged timeline with the bars of the symbols that have one at that timestamp in self.rows,
+    # trades have to be opened with the symbol they belong to
+    def __init__(self,
+                 dfs,
+                 broker=None,
+                 resample_equity_timeframe='D',
+                 enforce_stop_loss_first=True,
+                 allow_same_row_exit=False,
+                 on_stop_loss=None,
+                 on_take_profit=None):
+        super(PortfolioBacktest, self).__init__(None, broker, resample_equity_timeframe, enforce_stop_loss_first,
+                                                allow_same_row_exit, on_stop_loss, on_take_profit)
+        self.dfs = dfs
+        self.symbols = list(dfs)
+        self.symbol_bars = {}
+        self.rows = {}
+        self.previous_rows = {}
+        # position of the current bar of every symbol in its bars
+        self.bar_indexes = {}
+        self.dt = None
+
+    def get_lookback(self, column, n):
+        raise NotImplementedError('a portfolio has bars per symbol, use get_symbol_lookback')
+
+    def get_symbol_lookback(self, symbol, column, n):
+        # values of a column of a symbol for its last n bars up to and including the current one
+        bar_index = self.bar_indexes[symbol]
+        return self.symbol_bars[symbol].columns[column][max(bar_index - n + 1, 0):bar_index + 1]
+
+    def run_symbol_take_profit_and_stop_loss(self, symbol, ignore_positions=None):
+        self.bars = self.symbol_bars[symbol]
+        self.bar_index = self.bar_indexes[symbol]
+        self.row = self.rows[symbol]
+        self.previous_row = self.previous_rows.get(symbol)
+        self.run_positions_take_profit_and_stop_loss(ignore_positions, symbol)
+
+    def walk_forward(self, fold_size, start=-1, end=-1):
+        raise NotImplementedError('portfolio backtests have no state to continue from, walk forward is not supported')
+
+    def run_cached(self, cache, start=-1, end=-1):
+        raise NotImplementedError('portfolio backtests are not cached')
+
+    def optimize(self, *args, **kwargs):
+        raise NotImplementedError('portfolio backtests are not optimized')
+
+    def run(self, start=-1, end=-1):
+        self.symbol_bars = {symbol: Bars(self.dfs[symbol]) for symbol in self.symbols}
+        times, symbol_ids, positions = merge_timelines([get_index_ns(self.symbol_bars[symbol].index)
+                                                        for symbol in self.symbols])
+        # entries of every timestamp of the merged timeline
+        group_starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+        group_ends = np.r_[group_starts[1:], len(times)]
+        self.index = 0 if start == -1 else start
+        end = self.get_run_end(end, len(group_starts))
+        self.broker.reset()
+        self.rows = {}
+        self.previous_rows = {}
+        self.bar_indexes = {}
+        symbol_ids = symbol_ids.tolist()
+        positions = positions.tolist()
+        group_starts = group_starts.tolist()
+        group_ends = group_ends.tolist()
+        self.start_dt = None
+        while self.index < end:
+            self.rows = {}
+            for i in range(group_starts[self.index], group_ends[self.index]):
+                symbol = self.symbols[symbol_ids[i]]
+                self.bar_indexes[symbol] = positions[i]
+                self.rows[symbol] = self.symbol_bars[symbol].bar(positions[i])
+                self.run_symbol_take_profit_and_stop_loss(symbol)
+            self.dt = self.row.name
+            if self.start_dt is None:
+                self.start_dt = self.dt
+            if self.allow_same_row_exit:
+                positions_before = set(self.broker.positions)
+            # the bars of the symbol processed last aren't those of next(), which gets the bars of all of them
+            self.bars = self.bar_index = self.row = self.previous_row = None
+            self.next()
+            if self.broker.symbol_positions.get(None):
+                # the stop loss and take profit of a trade are only looked at on the bars of its symbol
+                raise ValueError('trades of a portfolio backtest have to be opened with their symbol')
+            for symbol, row in self.rows.items():
+                if self.allow_same_row_exit:
+                    self.run_symbol_take_profit_and_stop_loss(symbol, positions_before)
+                self.previous_rows[symbol] = row
+            self.index += 1
+        self.end_dt = self.dt
+        self.finish_run(start, end)
@@ -0,0 +1,115 @@
+import time
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from .trade import CLOSE_MANUAL, CLOSE_STOP_LOSS, CLOSE_TAKE_PROFIT
+
+PHASES = ('next', 'take_profit_and_stop_loss', 'broker', 'stats')
+PERCENTILES = (50, 90, 99)
+
+
+class Profiler:
+    # opt-in timing of the phases of a backtest, the methods of the backtest and its broker are replaced by timed
+    # wrappers on the instances only while a profiled run is going on, so the bar loop itself stays untouched,
+    # timings are inclusive, e.g. take_profit_and_stop_loss contains the time the broker needs to close the trades
+    def __init__(self):
+        self.durations = {phase: array('q') for phase in PHASES}
+        self.bars = 0
+        self.run_time = 0
+        self.trades_opened = 0
+        self.trades_closed = 0
+        self.stop_loss_hits = 0
+        self.take_profit_hits = 0
+
+    def timed(self, phase, method):
+        durations = self.durations[phase]
+
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter_ns()
+            result = method(*args, **kwargs)
+            durations.append(time.perf_counter_ns() - start)
+            return result
+        return timed_method
+
+    def counted_open(self, method):
+        def counted_method(*args, **kwargs):
+            self.trades_opened += 1
+            return method(*args, **kwargs)
+        return counted_method
+
+    def counted_close(self, method):
+        def counted_method(*args, **kwargs):
+            # same signature as Broker.close_long and Broker.close_short
+            close_reason = args[4] if len(args) > 4 else kwargs.get('close_reason', CLOSE_MANUAL)
+            self.trades_closed += 1
+            if close_reason == CLOSE_STOP_LOSS:
+                self.stop_loss_hits += 1
+            elif close_reason == CLOSE_TAKE_PROFIT:
+                self.take_profit_hits += 1
+            return method(*args, **kwargs)
+        return counted_method
+
+    def attach(self, backtest):
+        backtest.next = self.timed('next', backtest.next)
+        backtest.run_positions_take_profit_and_stop_loss = \
+            self.timed('take_profit_and_stop_loss', backtest.run_positions_take_profit_and_stop_loss)
+        broker = backtest.broker
+        broker.open_long = self.counted_open(self.timed('broker', broker.open_long))
+        broker.open_short = self.counted_open(self.timed('broker', broker.open_short))
+        broker.close_long = self.counted_close(self.timed('broker', broker.close_long))
+        broker.close_short = self.counted_close(self.timed('broker', broker.close_short))
+
+    @staticmethod
+    def detach(backtest):
+        # drop the wrappers, which makes the methods of the classes visible again
+        for obj, names in ((backtest, ('next', 'run_positions_take_profit_and_stop_loss')),
+                           (backtest.broker, ('open_long', 'open_short', 'close_long', 'close_short'))):
+            for name in names:
+                obj.__dict__.pop(name, None)
+
+    def run(self, backtest, start=-1, end=-1):
+        self.attach(backtest)
+        try:
+            index = 0 if start == -1 else start
+            run_start = time.perf_counter_ns()
+            backtest.run(start, end)
+            self.run_time += time.perf_counter_ns() - run_start
+            self.bars += backtest.index - index
+            stats_start = time.perf_counter_ns()
+            backtest.stats.do_analysis()
+            self.durations['stats'].append(time.perf_counter_ns() - stats_start)
+        finally:
+            self.detach(backtest)
+        return self
+
+    def get_phase_stats(self, phase):
+        durations = np.array(self.durations[phase], dtype=np.int64) / 1e9
+        stats = {'calls': len(durations), 'total': float(durations.sum())}
+        stats['mean'] = float(durations.mean()) if len(durations) else None
+        for percentile in PERCENTILES:
+            stats[f'p{percentile}'] = float(np.percentile(durations, percentile)) if len(durations) else None
+        return stats
+
+    def to_dict(self):
+        # flat dict of the counters and the timings of every phase in seconds
+        run_time = self.run_time / 1e9
+        result = {
+            'bars': self.bars,
+            'run_time': run_time,
+            'bars_per_sec': self.bars / run_time if run_time else None,
+            'trades_opened': self.trades_opened,
+            'trades_closed': self.trades_closed,
+            'trades_per_sec': self.trades_closed / run_time if run_time else None,
+            'stop_loss_hits': self.stop_loss_hits,
+            'take_profit_hits': self.take_profit_hits
+        }
+        for phase in PHASES:
+            for name, value in self.get_phase_stats(phase).items():
+                result[f'{phase}_{name}'] = value
+        return result
+
+    def to_df(self):
+        # timings in seconds, one row per phase
+        return pd.DataFrame.from_dict({phase: self.get_phase_stats(phase) for phase in PHASES}, orient='index')
@@ -0,0 +1,127 @@
+import numpy as np
+
+from .bar import Bars
+from .backtest import STATE_EXCLUDED_ATTRIBUTES, Backtest
+from .exit_book import find_first_cross, is_level
+
+
+def to_levels(levels, n):
+    # stop loss or take profit level per bar, nan where there is none
+    if levels is None:
+        return np.full(n, np.nan)
+    levels = np.asarray(levels, dtype=float)
+    return np.full(n, levels) if levels.ndim == 0 else levels
+
+
+# the signals and levels are inputs, a run doesn't change them
+SIGNAL_STATE_EXCLUDED_ATTRIBUTES = STATE_EXCLUDED_ATTRIBUTES | {'entries', 'exits', 'stop_loss', 'take_profit'}
+
+
+class SignalBacktest(Backtest):
+    # backtest of a strategy given as signal arrays: without an open position a trade is opened at the close of
+    # every bar with an entry signal, with the stop loss and take profit of that bar, an open position is closed at
+    # the close of the next bar with an exit signal unless its stop loss or take profit is reached first,
+    # run() jumps from trade to trade with numpy searches instead of calling next() for every bar,
+    # run(vectorized=False) runs the same strategy bar by bar through next() and gives the same history and stats
+    state_excluded_attributes = SIGNAL_STATE_EXCLUDED_ATTRIBUTES
+
+    def __init__(self,
+                 df,
+                 entries,
+                 exits=None,
+                 stop_loss=None,
+                 take_profit=None,
+                 short=False,
+                 total=100,
+                 leverage=1,
+                 broker=None,
+                 **backtest_kwargs):
+        super(SignalBacktest, self).__init__(df, broker, **backtest_kwargs)
+        assert self.df is not None, 'signal backtests need the history as a dataframe'
+        n = len(df)
+        self.entries = np.asarray(entries, dtype=bool)
+        self.exits = np.zeros(n, dtype=bool) if exits is None else np.asarray(exits, dtype=bool)
+        self.stop_loss = to_levels(stop_loss, n)
+        self.take_profit = to_levels(take_profit, n)
+        assert len(self.entries) == len(self.exits) == len(self.stop_loss) == len(self.take_profit) == n
+        self.short = short
+        self.total = total
+        self.leverage = leverage
+
+    def open_position(self, i, open_dt):
+        stop_loss = None if np.isnan(self.stop_loss[i]) else self.stop_loss[i].item()
+        take_profit = None if np.isnan(self.take_profit[i]) else self.take_profit[i].item()
+        open_trade = self.broker.open_short if self.short else self.broker.open_long
+        return open_trade(self.bars.Close[i], self.total, open_dt, self.broker.taker_fee, self.leverage,
+                          stop_loss, take_profit)
+
+    def close_positions(self, price, close_dt):
+        for trade in list(self.broker.positions):
+            self.broker.close_trade(price, trade, close_dt, self.broker.taker_fee)
+
+    def next(self):
+        if self.broker.positions:
+            if self.exits[self.index]:
+                self.close_positions(self.row.Close, self.row.name)
+        elif self.entries[self.index]:
+            self.open_position(self.index, self.row.name)
+
+    def set_bar(self, i, start):
+        self.index = self.bar_index = i
+        self.row = self.bars.bar(i)
+        self.previous_row = self.bars.bar(i - 1) if i > start else None
+
+    def run(self, start=-1, end=-1, vectorized=True, state=None, save_state=False):
+        # runs continued from or saving a state go bar by bar
+        if not vectorized or state is not None or save_state:
+            return super(SignalBacktest, self).run(start, end, state, save_state)
+        start = 0 if start == -1 else start
+        self.index = start
+        end = self.get_run_end(end, len(self.df))
+        self.broker.reset()
+        self.bars = Bars(self.df)
+        lows, highs = self.bars.Low, self.bars.High
+        entry_indexes = np.flatnonzero(self.entries)
+        exit_indexes = np.flatnonzero(self.exits)
+        i = start
+        while True:
+            # next bar with an entry signal
+            entry = np.searchsorted(entry_indexes, i)
+            if entry == len(entry_indexes) or entry_indexes[entry] >= end:
+                break
+            j = entry_indexes[entry].item()
+            self.set_bar(j, start)
+            trade = self.open_position(j, self.row.name)
+            if self.allow_same_row_exit:
+                self.run_positions_take_profit_and_stop_loss(set())
+                if not self.broker.positions:
+                    i = j + 1
+                    continue
+            # the position ends on the next exit signal or on the first bar reaching one of its levels before that,
+            # including the bar of the exit signal, as the levels are checked before next() is called
+            exit_ = np.searchsorted(exit_indexes, j, side='right')
+            x = exit_indexes[exit_].item() if exit_ < len(exit_indexes) else end
+            stop = min(x + 1, end)
+            if self.short:
+                low_level, high_level = trade.take_profit, trade.stop_loss
+            else:
+                low_level, high_level = trade.stop_loss, trade.take_profit
+            k = find_first_cross(lows, highs, low_level if is_level(low_level) else -np.inf,
+                                 high_level if is_level(high_level) else np.inf, j + 1, stop)
+            if k < stop:
+                # a new position may be opened right on the bar the levels closed the last one
+                self.set_bar(k, start)
+                self.run_positions_take_profit_and_stop_loss()
+                i = k
+            elif x < end:
+                self.set_bar(x, start)
+                self.close_positions(self.row.Close, self.row.name)
+                i = x + 1
+            else:
+                break
+        self.index = self.bar_index = end
+        self.start_dt = self.bars.index[start]
+        self.end_dt = self.bars.index[end - 1]
+        self.row = self.bars.bar(end - 1)
+        self.previous_row = self.row
+        self.finish_run(start, end)
@@ -1,6 +1,15 @@
+# reasons a trade has been closed for
+CLOSE_MANUAL = 0
+CLOSE_STOP_LOSS = 1
+CLOSE_TAKE_PROFIT = 2
+
+
 class Trade:
+    __slots__ = ('leveraged_quantity', 'leverage', 'leveraged_total_sold', 'leveraged_total_bought', 'open_dt',
+                 'close_dt', 'close_reason', 'symbol', 'exit_book', '_stop_loss', '_take_profit')
+
     def __init__(self, leveraged_quantity, leverage, leveraged_total_sold, leveraged_total_bought, open_dt,
-                 close_dt, stop_loss, take_profit):
+                 close_dt, stop_loss, take_profit, symbol=None):
         self.leveraged_quantity = leveraged_quantity
         assert leverage >= 1
         self.leverage = leverage
@@ -8,9 +17,33 @@ class Trade:
         self.leveraged_total_bought = leveraged_total_bought
         self.open_dt = open_dt
         self.close_dt = close_dt
+        self.close_reason = None
+        self.symbol = symbol
+        # exit book of the broker holding this trade, it is told whenever the stop loss or take profit changes
+        self.exit_book = None
         self.stop_loss = stop_loss
         self.take_profit = take_profit
 
+    @property
+    def stop_loss(self):
+        return self._stop_loss
+
+    @stop_loss.setter
+    def stop_loss(self, stop_loss):
+        self._stop_loss = stop_loss
+        if self.exit_book is not None:
+            self.exit_book.invalidate()
+
+    @property
+    def take_profit(self):
+        return self._take_profit
+
+    @take_profit.setter
+    def take_profit(self, take_profit):
+        self._take_profit = take_profit
+        if self.exit_book is not None:
+            self.exit_book.invalidate()
+
     def is_stop_loss(self, _):
         raise NotImplementedError
 
@@ -20,7 +53,7 @@ class Trade:
     def calc_profit(self):
         return self.leveraged_total_sold - self.leveraged_total_bought
 
-    def close(self, total_sold, close_dt):
+    def close(self, total_sold, close_dt, close_reason=CLOSE_MANUAL):
         raise NotImplementedError
 
     def get_duration(self):
@@ -28,16 +61,19 @@ class Trade:
 
 
 class Long(Trade):
+    __slots__ = ()
+
     def __init__(self, leveraged_quantity, leveraged_total_bought, open_dt, leverage=1,
-                 stop_loss=None, take_profit=None, leveraged_total_sold=None, close_dt=None):
+                 stop_loss=None, take_profit=None, leveraged_total_sold=None, close_dt=None, symbol=None):
         super(Long, self).__init__(leveraged_quantity, leverage, leveraged_total_sold, leveraged_total_bought,
-                                   open_dt, close_dt, stop_loss, take_profit)
+                                   open_dt, close_dt, stop_loss, take_profit, symbol)
         if self.stop_loss is not None and self.take_profit is not None:
             assert self.take_profit > self.stop_loss
 
-    def close(self, leveraged_total_sold, close_dt):
+    def close(self, leveraged_total_sold, close_dt, close_reason=CLOSE_MANUAL):
         self.leveraged_total_sold = leveraged_total_sold
         self.close_dt = close_dt
+        self.close_reason = close_reason
 
     def is_stop_loss(self, low):
         return self.stop_loss is not None and low <= self.stop_loss
@@ -47,16 +83,19 @@ class Long(Trade):
 
 
 class Short(Trade):
+    __slots__ = ()
+
     def __init__(self, leveraged_quantity, leveraged_total_sold, open_dt, leverage=1,
-                 stop_loss=None, take_profit=None, leveraged_total_bought=None, close_dt=None):
+                 stop_loss=None, take_profit=None, leveraged_total_bought=None, close_dt=None, symbol=None):
         super(Short, self).__init__(leveraged_quantity, leverage, leveraged_total_sold, leveraged_total_bought,
-                                    open_dt, close_dt, stop_loss, take_profit)
+                                    open_dt, close_dt, stop_loss, take_profit, symbol)
         if self.stop_loss is not None and self.take_profit is not None:
             assert self.stop_loss > self.take_profit
 
-    def close(self, leveraged_total_bought, close_dt):
+    def close(self, leveraged_total_bought, close_dt, close_reason=CLOSE_MANUAL):
         self.leveraged_total_bought = leveraged_total_bought
         self.close_dt = close_dt
+        self.close_reason = close_reason
 
     def is_stop_loss(self, high):
         return self.stop_loss is not None and high >= self.stop_loss
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+
+class WalkForward:
+    # runs a backtest fold by fold, every fold continues from the state the previous one ended with, so the
+    # strategy stays warmed up and a fold only processes its own bars, bars appended to the history later on
+    # are run the same way by update(), the stats of the backtest always cover everything since the first fold
+    def __init__(self, backtest):
+        self.backtest = backtest
+        self.start = -1
+        self.folds = []
+
+    def run_fold(self, end):
+        backtest = self.backtest
+        if backtest.state is None:
+            fold_start = 0 if self.start == -1 else self.start
+            trades_before = 0
+        else:
+            fold_start = backtest.state['attributes']['index']
+            trades_before = len(backtest.state['broker'].history)
+        if backtest.state is None:
+            backtest.run(self.start, end, save_state=True)
+        else:
+            backtest.run(end=end, state=backtest.state, save_state=True)
+        profits = backtest.broker.history.get_profits()
+        fold_profits = profits[trades_before:]
+        # realized equity, the positions still open at the end of the fold are carried over by the state
+        equity_before = backtest.broker.initial_equity + profits[:trades_before].sum()
+        self.folds.append({
+            'start': fold_start,
+            'end': backtest.index,
+            'end_dt': backtest.end_dt,
+            'trades': len(fold_profits),
+            'profit': fold_profits.sum(),
+            'return_perc': fold_profits.sum() / equity_before,
+            'win_rate': np.count_nonzero(fold_profits > 0) / len(fold_profits) if len(fold_profits) else None,
+            'open_positions': len(backtest.state['broker'].positions)
+        })
+        return self.folds[-1]
+
+    def run(self, fold_size, start=-1, end=-1):
+        # folds of fold_size bars from start to end, a streamed history needs an end
+        self.start = start
+        self.folds = []
+        self.backtest.state = None
+        fold_start = 0 if start == -1 else start
+        if end == -1:
+            assert self.backtest.df is not None, 'walk forward runs over a streamed history need an end'
+            end = len(self.backtest.df)
+        for fold_end in range(fold_start + fold_size, end + fold_size, fold_size):
+            self.run_fold(min(fold_end, end))
+        return self.to_df()
+
+    def update(self, df=None, end=-1):
+        # runs the bars appended to the history since the last fold as a new fold,
+        # df is the history including the new bars, unless the backtest streams it from a data source
+        if df is not None:
+            self.backtest.df = df
+        return self.run_fold(end)
+
+    def to_df(self):
+        return pd.DataFrame(self.folds)